@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Brocade Communications Systems, Inc.  All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+import json
+from threading import Lock, Thread
+from time import sleep
+import unittest
+
+from brocade_neutron_lbaas.vtm.abstract_product import ProductInstance,\
+                                                      gather
+from brocade_neutron_lbaas.vtm.vtm import vTM, vTMConfigObjectList
+
+POOL_CONFIG = json.dumps({"properties": {"basic": {
+    "nodes_table": [], "monitors": []
+}}})
+
+
+class StubConnector(object):
+    """
+    List connector that serves pools from memory and counts the requests
+    made for each of them.
+    """
+
+    def __init__(self, names, delay=0):
+        self.names = list(names)
+        self.delay = delay
+        self.requests = []
+        self._lock = Lock()
+
+    def __call__(self, name=None, method="GET", data=None, headers=None):
+        with self._lock:
+            self.requests.append((method, name))
+        sleep(self.delay)
+        if method == "PUT":
+            if name not in self.names:
+                self.names.append(name)
+            return data
+        if method == "DELETE":
+            self.names.remove(name)
+            return ""
+        if name is None:
+            return json.dumps({
+                "children": [{"name": child} for child in self.names]
+            })
+        if name not in self.names:
+            raise Exception("%s does not exist" % name)
+        return POOL_CONFIG
+
+    def count(self, method, name=None):
+        return self.requests.count((method, name))
+
+
+# Seconds to wait for a result before giving up
+TIMEOUT = 10
+
+
+class StubInstance(ProductInstance):
+    pool_class = vTM.config_classes['Pool']['class']
+    config_classes = {
+        "Pool": {
+            "class": pool_class, "path": "pools", "name": "pool",
+            "plural": "s"
+        },
+        "OtherPool": {
+            "class": pool_class, "path": "other_pools",
+            "name": "other_pool", "plural": "s"
+        }
+    }
+
+    def __init__(self, connectors):
+        super(StubInstance, self).__init__(
+            "http://stub.invalid/api", "user", "pass", vTMConfigObjectList,
+            True, populate_concurrency=4
+        )
+        self.pool.connector = connectors[0]
+        self.other_pool.connector = connectors[1]
+
+
+class TestConfigObjectListAsync(unittest.TestCase):
+    pool_class = StubInstance.pool_class
+
+    def test_crud_on_uninitialized_list(self):
+        connector = StubConnector(["a", "b"])
+        pools = vTMConfigObjectList(self.pool_class, connector, False)
+        created = gather([
+            pools.create_async("c", config=POOL_CONFIG),
+            pools.create_async("d", config=POOL_CONFIG)
+        ]).result(TIMEOUT)
+        self.assertEqual([obj.name for obj in created], ["c", "d"])
+        self.assertEqual(connector.count("PUT", "c"), 1)
+        self.assertEqual(
+            pools.list_async().result(TIMEOUT), ["a", "b", "c", "d"]
+        )
+        self.assertEqual(pools.get_async("b").result(TIMEOUT).name, "b")
+        self.assertEqual(pools.get_async("missing").result(TIMEOUT), None)
+
+    def test_crud_on_initialized_list(self):
+        connector = StubConnector(["a", "b"])
+        pools = vTMConfigObjectList(self.pool_class, connector, True)
+        pools.populate_from_instance_async().result(TIMEOUT)
+        self.assertEqual(pools.list_async().result(TIMEOUT), ["a", "b"])
+        pools.create_async("c", config=POOL_CONFIG).result(TIMEOUT)
+        pools.delete_async("a").result(TIMEOUT)
+        self.assertEqual(connector.count("DELETE", "a"), 1)
+        self.assertEqual(pools.list_async().result(TIMEOUT), ["b", "c"])
+        self.assertEqual(pools.get_async("a").result(TIMEOUT), None)
+
+    def test_errors_are_raised_from_result(self):
+        pools = vTMConfigObjectList(self.pool_class, StubConnector([]), True)
+        self.assertRaises(
+            Exception, pools.delete_async("missing").result, TIMEOUT
+        )
+
+
+class TestProductInstancePopulate(unittest.TestCase):
+
+    def test_populate_and_materialize_load_each_list_once(self):
+        connectors = [
+            StubConnector(["a-%d" % i for i in range(10)], delay=0.01),
+            StubConnector(["b-%d" % i for i in range(10)], delay=0.01)
+        ]
+        instance = StubInstance(connectors)
+        reader = Thread(target=instance.pool.materialize)
+        reader.start()
+        instance.populate_from_instance(4)
+        reader.join()
+        for connector in connectors:
+            self.assertEqual(connector.count("GET"), 1)
+        self.assertEqual(len(instance.pool), 10)
+        self.assertEqual(len(instance.other_pool), 10)
+        instance.close()
+
+    def test_populate_async_loads_every_list(self):
+        connectors = [StubConnector(["a", "b"]), StubConnector(["c"])]
+        instance = StubInstance(connectors)
+        instance.populate_from_instance_async().result(TIMEOUT)
+        self.assertEqual(
+            sorted(dict.keys(instance.pool)), ["a", "b"]
+        )
+        self.assertEqual(dict.keys(instance.other_pool), ["c"])
+        for connector in connectors:
+            self.assertEqual(connector.count("GET"), 1)
+        instance.close()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Brocade Communications Systems, Inc.  All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+import json
+from time import sleep
+import unittest
+
+from brocade_neutron_lbaas.vtm.abstract_product import Future, WorkerPool,\
+                                                      gather, worker_pool
+from brocade_neutron_lbaas.vtm.vtm import vTM, vTMConfigObjectList
+
+# Seconds to wait for a result before deciding the pool is deadlocked
+TIMEOUT = 10
+
+
+def stub_connector(names, delay=0):
+    """
+    Gets a list connector that serves the named pools from memory.
+    """
+    def connector(name=None, method="GET", data=None, headers=None):
+        sleep(delay)
+        if name is None:
+            return json.dumps({
+                "children": [{"name": child} for child in names]
+            })
+        return json.dumps({"properties": {"basic": {
+            "nodes_table": [], "monitors": []
+        }}})
+    return connector
+
+
+class TestFuture(unittest.TestCase):
+
+    def test_callback_added_after_completion_runs_immediately(self):
+        future = Future()
+        seen = []
+        future.add_done_callback(lambda f: seen.append(f.result()))
+        self.assertEqual(seen, [])
+        future.set_result(1)
+        future.add_done_callback(lambda f: seen.append(f.result()))
+        self.assertEqual(seen, [1, 1])
+
+    def test_then_chains_results_and_futures(self):
+        pool = WorkerPool(2)
+        future = pool.submit(lambda: 2).then(lambda value: value + 1).then(
+            lambda value: pool.submit(lambda: value * 10)
+        )
+        self.assertEqual(future.result(TIMEOUT), 30)
+
+    def test_then_passes_errors_on(self):
+        def fail():
+            raise ValueError("broken")
+        called = []
+        future = WorkerPool(1).submit(fail).then(called.append)
+        self.assertRaises(ValueError, future.result, TIMEOUT)
+        self.assertTrue(isinstance(future.exception(), ValueError))
+        self.assertEqual(called, [])
+
+    def test_result_times_out(self):
+        self.assertRaises(Exception, Future().result, 0.01)
+
+
+class TestGather(unittest.TestCase):
+
+    def test_empty(self):
+        self.assertEqual(gather([]).result(0), [])
+
+    def test_results_keep_submission_order(self):
+        pool = WorkerPool(4)
+        futures = [
+            pool.submit(lambda i: sleep(0.01 * (4 - i)) or i, i)
+            for i in range(4)
+        ]
+        self.assertEqual(gather(futures).result(TIMEOUT), [0, 1, 2, 3])
+
+    def test_failure_raised_after_all_complete(self):
+        pool = WorkerPool(2)
+        finished = []
+
+        def slow():
+            sleep(0.05)
+            finished.append(True)
+
+        def fail():
+            raise ValueError("broken")
+        future = gather([pool.submit(fail), pool.submit(slow)])
+        self.assertRaises(ValueError, future.result, TIMEOUT)
+        self.assertEqual(finished, [True])
+
+
+class TestWorkerPoolMap(unittest.TestCase):
+
+    def test_map_on_worker_runs_inline(self):
+        pool = WorkerPool(1)
+        for limit in (None, 4):
+            future = pool.submit(
+                pool.map, lambda item: item * 2, range(5), limit
+            )
+            self.assertEqual(future.result(TIMEOUT), [0, 2, 4, 6, 8])
+
+    def test_map_limit_raises_first_error(self):
+        def fail_on_three(item):
+            if item == 3:
+                raise ValueError(item)
+            return item
+        pool = WorkerPool(4)
+        self.assertRaises(ValueError, pool.map, fail_on_three, range(6), 2)
+
+    def test_concurrent_reads_during_lazy_populate(self):
+        # Every worker reads the list while one of them populates it with
+        # a concurrency limit; the populate mustn't wait for free workers
+        pool_class = vTM.config_classes['Pool']['class']
+        pools = vTMConfigObjectList(
+            pool_class, stub_connector(["pool-%d" % i for i in range(20)],
+                                       delay=0.01), True
+        )
+        pools.populate_lazily(8)
+        futures = [
+            pools.get_async("pool-%d" % i)
+            for i in range(worker_pool.size + 4)
+        ]
+        results = gather(futures).result(TIMEOUT)
+        self.assertEqual(
+            [obj.name for obj in results],
+            ["pool-%d" % i for i in range(worker_pool.size + 4)]
+        )
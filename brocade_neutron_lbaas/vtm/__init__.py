@@ -69,6 +69,15 @@ services_director_setting_opts = [
                help=_('Feature Pack resource for vTM instances')),
     cfg.StrOpt('fla_license', default="universal_v3",
                help=_('FLA license resource to apply to vTM instances')),
+    cfg.IntOpt('health_check_interval', default=10,
+               help=_('Seconds between background connectivity checks of '
+               'each Services Director')),
+    cfg.IntOpt('health_failure_threshold', default=2,
+               help=_('Consecutive failed checks after which a Services '
+               'Director is skipped')),
+    cfg.IntOpt('health_reset_timeout', default=30,
+               help=_('Seconds before a skipped Services Director is '
+               'checked again')),
     cfg.StrOpt('password',
                help=_('Password of Services Director admin account')),
     cfg.IntOpt('rest_port', default=8100,
@@ -77,6 +86,25 @@ services_director_setting_opts = [
     cfg.StrOpt('username', default="admin",
                help=_('Username of Services Director admin account'))
 ]
+slow_log_setting_opts = [
+    cfg.StrOpt('file',
+               help=_('File to append slow request entries to as lines of '
+               'JSON. If unset, they are logged as warnings')),
+    cfg.FloatOpt('threshold', default=0,
+                 help=_('Seconds after which a vTM, Services Director or '
+                 'OpenStack call is logged as slow (0 disables the slow '
+                 'log)'))
+]
+tracing_setting_opts = [
+    cfg.StrOpt('exporter',
+               help=_('Where to send a timing tree of each driver '
+               'operation: "jsonlines" to append them to the tracing file, '
+               'or the dotted path of an exporter class. Unset disables '
+               'tracing')),
+    cfg.StrOpt('file', default="/var/log/neutron/brocade_lbaas_traces.jsonl",
+               help=_('File that the jsonlines tracing exporter appends '
+               'to'))
+]
 vtm_setting_opts = [
     cfg.IntOpt('admin_port', default=9090,
                help=_('Port that the vTM admin interface listens on')),
@@ -84,8 +112,29 @@ vtm_setting_opts = [
                help=_('Version of Stingray REST API to use')),
     cfg.IntOpt('cluster_port', default=9080,
                help=_('Port that the vTM cluster healthchecks on')),
+    cfg.BoolOpt('config_mirror', default=False,
+                help=_('Keep an in-memory copy of the configuration read '
+                'from and written to each vTM, so repeated reads do not '
+                'need a REST call. Only enable this if no other Neutron '
+                'server or worker configures the same vTMs, as their '
+                'changes could otherwise be overwritten')),
+    cfg.IntOpt('config_mirror_ttl', default=30,
+               help=_('Seconds a mirrored configuration object is trusted '
+               'before it is read from the vTM again (0 for no limit). Keep '
+               'this short if other systems also configure the vTMs')),
     cfg.BoolOpt('gui_access', default=False,
                 help=_('Allow read-only access to the web GUI')),
+    cfg.IntOpt('handle_cache_size', default=128,
+               help=_('Maximum number of vTM connection objects to cache '
+               '(0 disables caching)')),
+    cfg.IntOpt('handle_cache_ttl', default=60,
+               help=_('Seconds a cached vTM connection object is used '
+               'before its connectivity is re-tested')),
+    cfg.IntOpt('health_failure_threshold', default=2,
+               help=_('Consecutive failed requests after which a vTM is '
+               'skipped')),
+    cfg.IntOpt('health_reset_timeout', default=30,
+               help=_('Seconds before a skipped vTM is tested again')),
     cfg.IntOpt('mtu', default=1454,
                help=_('MTU for the vTM instance interfaces')),
     cfg.ListOpt('nameservers',
@@ -94,14 +143,123 @@ vtm_setting_opts = [
                help=_('Password of vTM admin account')),
     cfg.IntOpt('rest_port', default=9070,
                help=_('TCP port that the vTM REST daemon listens on')),
+    cfg.IntOpt('stats_interval', default=10,
+               help=_('Seconds between background reads of the statistics '
+               'of each vTM that the LBaaS plugin polls (0 to read them '
+               'when they are requested)')),
+    cfg.IntOpt('stats_max_age', default=300,
+               help=_('Seconds for which collected statistics are served '
+               'while a vTM cannot be reached, and for which statistics '
+               'nobody has requested are still collected')),
+    cfg.IntOpt('stats_samples', default=60,
+               help=_('Number of collected statistics samples kept for each '
+               'vTM and listen IP to calculate traffic rates from')),
     cfg.StrOpt('timezone', default="Europe/London",
                help=_('Timezone to set vTM clock to')),
+    cfg.IntOpt('unchanged_write_ttl', default=0,
+               help=_('Seconds for which re-creating a vTM configuration '
+               'object with exactly the body last written is skipped '
+               '(0 to always send the write). Only enable this if no other '
+               'Neutron server or worker configures the same vTMs, as '
+               'objects they delete are not re-created meanwhile')),
     cfg.StrOpt('username', default="admin",
                help=_('Username for vTM admin account'))
 ]
+http_setting_opts = [
+    cfg.FloatOpt('connect_timeout', default=10,
+                 help=_('Seconds to wait for a connection to a vTM, '
+                 'Services Director or OpenStack API endpoint')),
+    cfg.BoolOpt('hedge_reads', default=False,
+                help=_('Race slow GET requests against another Services '
+                'Director to cut tail latency')),
+    cfg.FloatOpt('hedge_min_delay', default=0.05,
+                 help=_('Minimum seconds to wait before racing a GET '
+                 'request against another Services Director')),
+    cfg.IntOpt('hedge_percentile', default=95,
+               help=_('Latency percentile of recent GETs after which a '
+               'request is raced against another Services Director')),
+    cfg.IntOpt('max_concurrent_requests', default=16,
+               help=_('Number of worker threads used to make independent '
+               'REST calls concurrently')),
+    cfg.IntOpt('pool_connections', default=10,
+               help=_('Number of per-host HTTP connection pools to keep')),
+    cfg.IntOpt('pool_maxsize', default=10,
+               help=_('Maximum number of keep-alive connections to keep '
+               'open to each vTM or Services Director')),
+    cfg.BoolOpt('pool_block', default=False,
+                help=_('If set to True, requests wait for a free pooled '
+                'connection rather than opening an unpooled one')),
+    cfg.IntOpt('populate_concurrency', default=8,
+               help=_('Maximum number of configuration objects fetched at '
+               'once when loading the full configuration of a Services '
+               'Director or vTM')),
+    cfg.IntOpt('prewarm_connections', default=0,
+               help=_('Number of connections to open to each admin server '
+               'when the driver starts (0 disables pre-warming)')),
+    cfg.FloatOpt('read_timeout', default=60,
+                 help=_('Seconds to wait for a response from a vTM, '
+                 'Services Director or OpenStack API endpoint'))
+]
+metrics_setting_opts = [
+    cfg.StrOpt('file',
+               help=_('File to write driver metrics to in OpenMetrics text '
+               'format')),
+    cfg.IntOpt('file_interval', default=15,
+               help=_('Seconds between rewrites of the metrics file')),
+    cfg.StrOpt('listen_address', default="127.0.0.1",
+               help=_('Address of the HTTP listener that serves driver '
+               'metrics')),
+    cfg.IntOpt('listen_port', default=0,
+               help=_('TCP port of the HTTP listener that serves driver '
+               'metrics in OpenMetrics text format (0 disables it)'))
+]
+profiling_setting_opts = [
+    cfg.StrOpt('directory',
+               default="/var/log/neutron/brocade_lbaas_profiles",
+               help=_('Directory to write collapsed-stack CPU profiles of '
+               'driver methods to, one file per method and process')),
+    cfg.FloatOpt('interval', default=0.005,
+                 help=_('Seconds of CPU time between stack samples of a '
+                 'profiled call')),
+    cfg.IntOpt('memory_diff_top', default=10,
+               help=_('Number of allocation sites (or object types, without '
+               'tracemalloc) kept for each driver operation memory diff')),
+    cfg.BoolOpt('memory_diffs', default=False,
+                help=_('Record how memory changed across each driver '
+                'operation, for the memory_report() diagnostic call. This '
+                'slows every operation down')),
+    cfg.FloatOpt('sample_rate', default=0.0,
+                 help=_('Fraction of driver method calls to profile, from '
+                 '0 (profiling disabled) to 1 (every call)'))
+]
+retry_setting_opts = [
+    cfg.DictOpt('await_build',
+                default={"base_delay": 2, "max_delay": 15, "deadline": 900},
+                help=_('Retry policy for polling Nova until a vTM instance '
+                'has been built')),
+    cfg.DictOpt('get_services_director',
+                default={"max_attempts": 3, "base_delay": 1, "max_delay": 4},
+                help=_('Retry policy for finding a reachable Services '
+                'Director')),
+    cfg.DictOpt('get_vtm',
+                default={"max_attempts": 5, "base_delay": 0.5,
+                         "max_delay": 4, "deadline": 30},
+                help=_('Retry policy for contacting an existing vTM')),
+    cfg.DictOpt('spawn_vtm',
+                default={"base_delay": 2, "multiplier": 1.5,
+                         "max_delay": 15, "deadline": 300},
+                help=_('Retry policy for waiting for a new vTM instance to '
+                'become reachable through Services Director'))
+]
 cfg.CONF.register_opts(lbaas_setting_opts, "lbaas_settings")
+cfg.CONF.register_opts(metrics_setting_opts, "metrics_settings")
+cfg.CONF.register_opts(profiling_setting_opts, "profiling_settings")
+cfg.CONF.register_opts(retry_setting_opts, "retry_settings")
+cfg.CONF.register_opts(http_setting_opts, "http_settings")
 cfg.CONF.register_opts(services_director_setting_opts,
                        "services_director_settings")
+cfg.CONF.register_opts(slow_log_setting_opts, "slow_log_settings")
+cfg.CONF.register_opts(tracing_setting_opts, "tracing_settings")
 cfg.CONF.register_opts(vtm_setting_opts, "vtm_settings")
 
 if cfg.CONF.lbaas_settings.deployment_model is None:
@@ -18,24 +18,443 @@
 #
 
 from abc import ABCMeta, abstractmethod
+from collections import deque
+from hashlib import sha1
 import json
+from memory import approximate_size
+import metrics
+from Queue import Empty, Queue
 import requests
+from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
-from threading import Thread
+from slow_log import slow_log
+import sys
+from threading import Event, Lock, Thread, local
 from time import time, sleep
+from tracing import tracer
 from urllib import quote
+from urlparse import urlparse
 import urllib3
 
 # Disable warnings for self-signed certs
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
 
+class RESTError(Exception):
+    """
+    Failed REST call.  status_code is None if no response was received.
+    """
+
+    def __init__(self, message, status_code=None):
+        super(RESTError, self).__init__(message)
+        self.status_code = status_code
+
+
+###############################################################################
+#                              Pooled HTTP sessions                           #
+###############################################################################
+
+class HTTPSessionRegistry(object):
+    """
+    Process-wide registry of pooled HTTP sessions.
+
+    A single requests.Session is kept for each endpoint (scheme, host and
+    port) and set of credentials, so every ProductInstance that talks to the
+    same vTM or Services Director shares one pool of keep-alive connections
+    instead of opening a new TCP connection and TLS handshake per object.
+    Sessions taken with acquire() are closed and forgotten once every
+    acquirer has called release().
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=10,
+                 pool_block=False, timeout=None):
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self.timeout = timeout
+        self._sessions = {}
+        self._users = {}
+        self._lock = Lock()
+
+    def configure(self, pool_connections=None, pool_maxsize=None,
+                  pool_block=None, connect_timeout=None, read_timeout=None):
+        """
+        Sets the urllib3 pool parameters used for sessions created from now
+        on (sessions that already exist keep their current pools), and the
+        (connect, read) timeout used for every request.
+        """
+        if pool_connections is not None:
+            self.pool_connections = pool_connections
+        if pool_maxsize is not None:
+            self.pool_maxsize = pool_maxsize
+        if pool_block is not None:
+            self.pool_block = pool_block
+        if connect_timeout is not None or read_timeout is not None:
+            self.timeout = (connect_timeout, read_timeout)
+
+    def get_session(self, url, username, password):
+        """
+        Gets the shared session for the endpoint of a URL, creating it if
+        necessary.
+        """
+        key = (self._endpoint(url), username, password)
+        with self._lock:
+            return self._session(key)
+
+    def acquire(self, url, username, password):
+        """
+        Gets the shared session for the endpoint of a URL like
+        get_session(), counting the caller as one of its users until it
+        calls release().
+        """
+        key = (self._endpoint(url), username, password)
+        with self._lock:
+            session = self._session(key)
+            self._users[key] = self._users.get(key, 0) + 1
+            return session
+
+    def release(self, url, username, password):
+        """
+        Stops counting one user of the session for the endpoint of a URL.
+        Once it has no users left, e.g. because the tenant vTMs reached
+        through it have been destroyed, its pooled connections are closed
+        and it is forgotten.
+        """
+        key = (self._endpoint(url), username, password)
+        with self._lock:
+            users = self._users.get(key, 0) - 1
+            if users > 0:
+                self._users[key] = users
+                return
+            self._users.pop(key, None)
+            session = self._sessions.pop(key, None)
+        if session is not None:
+            session.close()
+
+    def prewarm(self, url, username, password, connections=1):
+        """
+        Opens keep-alive connections to the endpoint of a URL in the
+        background, so the first real request doesn't pay for the TCP and
+        TLS handshakes.  Failures are ignored.
+        """
+        session = self.get_session(url, username, password)
+
+        def warm():
+            try:
+                session.head(url, timeout=self.timeout)
+            except Exception:
+                pass
+        for _ in xrange(min(connections, self.pool_maxsize)):
+            thread = Thread(target=warm)
+            thread.daemon = True
+            thread.start()
+
+    def close_all(self):
+        """
+        Closes every pooled connection and forgets all sessions.
+        """
+        with self._lock:
+            for session in self._sessions.itervalues():
+                session.close()
+            self._sessions = {}
+            self._users = {}
+
+    def _session(self, key):
+        # Must be called with the lock held
+        try:
+            return self._sessions[key]
+        except KeyError:
+            pass
+        session = requests.Session()
+        session.verify = False
+        session.auth = (key[1], key[2])
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize,
+            pool_block=self.pool_block
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        self._sessions[key] = session
+        return session
+
+    def _endpoint(self, url):
+        parsed = urlparse(url)
+        return "%s://%s" % (parsed.scheme, parsed.netloc)
+
+
+http_sessions = HTTPSessionRegistry()
+
+
+###############################################################################
+#                             Concurrent execution                            #
+###############################################################################
+
+class Future(object):
+    """
+    Result of a call running on a WorkerPool.
+    """
+
+    def __init__(self):
+        self._event = Event()
+        self._lock = Lock()
+        self._callbacks = []
+        self._result = None
+        self._exc_info = None
+
+    def done(self):
+        return self._event.is_set()
+
+    def result(self, timeout=None):
+        if not self._event.wait(timeout):
+            raise Exception("Timed out waiting for result")
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self):
+        self._event.wait()
+        return self._exc_info[1] if self._exc_info else None
+
+    def add_done_callback(self, callback):
+        """
+        Calls callback(future) once the result is available.  If it
+        already is, the callback runs immediately in the calling thread.
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def then(self, func):
+        """
+        Gets a Future for func(result).  If func returns a Future, the new
+        Future completes when that one does.
+        """
+        chained = Future()
+
+        def on_done(future):
+            if future._exc_info is not None:
+                chained.set_exception(future._exc_info)
+                return
+            try:
+                result = func(future._result)
+            except Exception:
+                chained.set_exception(sys.exc_info())
+                return
+            if isinstance(result, Future):
+                result.add_done_callback(chained._copy_from)
+            else:
+                chained.set_result(result)
+        self.add_done_callback(on_done)
+        return chained
+
+    def set_result(self, result):
+        self._complete(result, None)
+
+    def set_exception(self, exc_info):
+        self._complete(None, exc_info)
+
+    def _copy_from(self, future):
+        self._complete(future._result, future._exc_info)
+
+    def _complete(self, result, exc_info):
+        with self._lock:
+            self._result = result
+            self._exc_info = exc_info
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                pass
+
+
+def gather(futures):
+    """
+    Gets a Future for the list of results of several Futures.  If any of
+    them fails, the first failure is raised once all have completed.
+    """
+    combined = Future()
+    futures = list(futures)
+    remaining = [len(futures)]
+    lock = Lock()
+    if not futures:
+        combined.set_result([])
+        return combined
+
+    def on_done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] > 0:
+                return
+        for future in futures:
+            if future._exc_info is not None:
+                combined.set_exception(future._exc_info)
+                return
+        combined.set_result([future._result for future in futures])
+    for future in futures:
+        future.add_done_callback(on_done)
+    return combined
+
+
+class WorkerPool(object):
+    """
+    Bounded pool of worker threads for running REST calls concurrently.
+
+    Worker threads are started on first use.  Work run on the pool must
+    not block waiting for other work on the same pool; chain dependent
+    calls with Future.then() instead.
+    """
+
+    def __init__(self, size=16):
+        self.size = size
+        self._queue = Queue()
+        self._workers = []
+        self._lock = Lock()
+        self._local = local()
+
+    def in_worker(self):
+        """
+        Tells whether the calling thread is one of the pool's workers.
+        """
+        return getattr(self._local, "is_worker", False)
+
+    def resize(self, size):
+        """
+        Sets the number of worker threads.  The pool only ever grows;
+        surplus workers are kept until the process exits.
+        """
+        self.size = size
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        self._start_workers()
+        self._queue.put((future, tracer.bind(func), args, kwargs))
+        return future
+
+    def map(self, func, items, limit=None):
+        """
+        Calls func on every item concurrently and waits for the results.
+        If a limit is given, at most that many calls run at once; after a
+        failure no further items are started and the first error is raised.
+        Called from one of the pool's own workers, the calls are made one
+        after another in that worker, since waiting on the pool could
+        deadlock once every worker is waiting.
+        """
+        items = list(items)
+        if self.in_worker() or (limit is not None and limit <= 1):
+            return [func(item) for item in items]
+        if limit is None:
+            return gather([self.submit(func, item) for item in items]).result()
+        results = [None] * len(items)
+        pending = iter(xrange(len(items)))
+        failed = Event()
+        lock = Lock()
+
+        def lane():
+            while not failed.is_set():
+                with lock:
+                    index = next(pending, None)
+                if index is None:
+                    return
+                try:
+                    results[index] = func(items[index])
+                except Exception:
+                    failed.set()
+                    raise
+        gather([
+            self.submit(lane) for _ in xrange(min(limit, len(items)))
+        ]).result()
+        return results
+
+    def _start_workers(self):
+        if len(self._workers) >= self.size:
+            return
+        with self._lock:
+            while len(self._workers) < self.size:
+                worker = Thread(target=self._work)
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+
+    def _work(self):
+        self._local.is_worker = True
+        while True:
+            future, func, args, kwargs = self._queue.get()
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception:
+                future.set_exception(sys.exc_info())
+
+
+worker_pool = WorkerPool()
+
+
 ###############################################################################
 #                           Abstract config object classes                    #
 ###############################################################################
 
+def _index_key(value):
+    """
+    Gets a hashable equivalent of a field value for use in an index.
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(_index_key(item) for item in value)
+    if isinstance(value, dict):
+        return tuple(sorted(
+            (key, _index_key(item)) for key, item in value.iteritems()
+        ))
+    return value
+
+
+def _index_keys(value):
+    """
+    Gets the keys a field value is indexed under: one per element for a
+    list, so that e.g. a traffic IP group is found by any of its machines.
+    """
+    if isinstance(value, (list, tuple)):
+        return frozenset(_index_key(item) for item in value)
+    return (_index_key(value),)
+
+
+def _flatten_fields(obj_dict, depth):
+    """
+    Maps the path of each field in a nested configuration dictionary to its
+    value, e.g. {("properties", "basic", "port"): 80} for a depth of 2.
+    """
+    if depth == 0:
+        return {(key,): value for key, value in obj_dict.iteritems()}
+    fields = {}
+    for key, section in obj_dict.iteritems():
+        for path, value in _flatten_fields(section, depth - 1).iteritems():
+            fields[(key,) + path] = value
+    return fields
+
+
+def _unflatten_fields(fields):
+    obj_dict = {}
+    for path, value in fields.iteritems():
+        section = obj_dict
+        for key in path[:-1]:
+            section = section.setdefault(key, {})
+        section[path[-1]] = value
+    return obj_dict
+
+
 class ConfigObject(object):
+    """
+    Base class for configuration objects.
+
+    Subclasses that set _field_depth (the number of section levels above
+    the individual fields in to_dict()) get change tracking: once
+    mark_clean() has been called, update() PUTs only the fields that have
+    changed since, and nothing at all if none have.
+    """
     __metadata__ = ABCMeta
+    _field_depth = None
 
     def __init__(self, name, object_type, *args, **kwargs):
         self.name = name
@@ -50,6 +469,32 @@ class ConfigObject(object):
     def create_from_config_data(self, data):
         return
 
+    def __setattr__(self, name, value):
+        super(ConfigObject, self).__setattr__(name, value)
+        self._field_changed(name)
+
+    def __delattr__(self, name):
+        super(ConfigObject, self).__delattr__(name)
+        self._field_changed(name)
+
+    def _field_changed(self, name):
+        # Keeps the parent list's indexes in step with assignments
+        parent_list = self.__dict__.get("_parent_list")
+        if parent_list is not None and name in parent_list._indexes:
+            parent_list.reindex(self.name)
+
+    def _index_values(self, attributes):
+        """
+        Gets the values of those of the given attributes that are set.
+        """
+        values = {}
+        for attribute in attributes:
+            try:
+                values[attribute] = getattr(self, attribute)
+            except AttributeError:
+                pass
+        return values
+
     def _process_additional_arguments(self, **kwargs):
         protected = ['update', 'delete']
         for field, value in kwargs.iteritems():
@@ -85,16 +530,62 @@ class ConfigObject(object):
                 raise Exception("Timeout waiting for field change")
         return current_value
 
+    def mark_clean(self):
+        """
+        Records the current field values as those held by the product.
+        """
+        if self._field_depth is None:
+            return
+        self._saved_fields = self._field_digests(self.to_dict())
+
+    def _field_digests(self, obj_dict):
+        return {
+            path: hash(json.dumps(value, sort_keys=True))
+            for path, value in _flatten_fields(
+                obj_dict, self._field_depth
+            ).iteritems()
+        }
+
+    def _saved_field_digests(self):
+        return getattr(self, "_saved_fields", None)
+
+    def _changed_fields_body(self):
+        """
+        Gets the PUT body holding only the fields changed since
+        mark_clean(), None if nothing changed, or the full object if
+        changes can't be tracked (e.g. a field was removed).
+        """
+        saved = self._saved_field_digests()
+        if saved is None:
+            return str(self)
+        fields = _flatten_fields(self.to_dict(), self._field_depth)
+        if not set(saved).issubset(fields):
+            return str(self)
+        changed = {
+            path: value for path, value in fields.iteritems()
+            if saved.get(path) != hash(json.dumps(value, sort_keys=True))
+        }
+        if not changed:
+            return None
+        return json.dumps(_unflatten_fields(changed))
+
     def update(self):
         try:
             if self._is_read_only is True:
                 raise Exception("This object is read-only.")
         except AttributeError:
             pass
+        body = self._changed_fields_body()
+        if body is None:
+            return
         try:
-            self.connector("PUT", str(self))
+            self.connector("PUT", body)
         except AttributeError:
             raise Exception("No connection associated with this object.")
+        self.mark_clean()
+        parent_list = getattr(self, "_parent_list", None)
+        if parent_list is not None:
+            parent_list.reindex(self.name)
 
     def delete(self):
         try:
@@ -141,22 +632,164 @@ class ConfigObjectList(dict):
 
     Maps object name to configuration object and provides methods for
     manupulating the dictionary.
+
+    An initialized list can be populated lazily: after populate_lazily(),
+    the objects are fetched from the product the first time the dictionary
+    is read.
+
+    After suppress_unchanged_writes(), create() skips the PUT when the body
+    is identical to the last one the product acknowledged for that name.
+
+    Attributes declared with add_index() are indexed for search(), list
+    values by each element.  The indexes follow objects being added to or
+    removed from the dictionary and indexed attributes being assigned or
+    saved with update(); a list value changed in place is only re-indexed
+    by update() or reindex().
     """
     __metadata__ = ABCMeta
+    _lazy_concurrency = None
+    _indexes = None
+    _indexed_keys = None
+    populate_timing = None
+    write_record_ttl = None
+    suppressed_writes = 0
 
     def __init__(self, object_class, connector, initialized):
         self.initialized = initialized
         self.object_class = object_class
         self.connector = connector
+        self._load_lock = Lock()
+        self._write_lock = Lock()
+        self._write_records = {}
+        self._indexes = {}
+        self._indexed_keys = {}
 
     @abstractmethod
-    def populate_from_instance(self):
+    def populate_from_instance(self, concurrency=1):
         return
 
-    def create(self, name, **kwargs):
+    def populate_lazily(self, concurrency=1):
+        """
+        Defers populate_from_instance() until the dictionary is first read.
+        """
+        self._lazy_concurrency = concurrency
+
+    def materialize(self):
+        """
+        Runs a deferred populate_from_instance() now, if one is pending.
+        populate_timing is then set to {"objects": count, "seconds": time}.
+        """
+        if self._lazy_concurrency is None:
+            return
+        with self._load_lock:
+            if self._lazy_concurrency is None:
+                return
+            start_time = time()
+            self.populate_from_instance(self._lazy_concurrency)
+            self.populate_timing = {
+                "objects": dict.__len__(self),
+                "seconds": time() - start_time
+            }
+            self._lazy_concurrency = None
+
+    def memory_usage(self):
+        """
+        Gets the approximate memory held by the list, without loading it if
+        it has not been loaded yet, as {"loaded": bool, "objects": count,
+        "bytes": size of the objects, "index_bytes": size of the indexes}.
+        """
+        seen = set()
+        stop_types = (ConfigObjectList, ProductInstance)
+        size = sum(
+            approximate_size(obj, seen, stop_types)
+            for obj in dict.values(self)
+        )
+        return {
+            "loaded": self._lazy_concurrency is None,
+            "objects": dict.__len__(self),
+            "bytes": size,
+            "index_bytes": sum(
+                approximate_size(index, seen) for index in self._index_data()
+            )
+        }
+
+    def _index_data(self):
+        # Containers counted as index_bytes by memory_usage()
+        return [self._indexes, self._indexed_keys]
+
+    def populate_from_instance_async(self):
+        """
+        Populates the dictionary with every child object's GET running
+        concurrently on the worker pool.  Returns a Future.
+        """
+        def populate_children(names):
+            return gather([
+                worker_pool.submit(self._populate_child, name)
+                for name in names
+            ])
+        return worker_pool.submit(self._child_names).then(populate_children)
+
+    def _child_names(self):
+        return [
+            child['name'] for child in json.loads(self.connector())['children']
+        ]
+
+    def _populate_child(self, name):
+        obj_data = self.connector(name)
+        try:
+            obj_config = json.loads(obj_data)  # Will fail for rules :S
+        except ValueError:
+            obj_config = obj_data
+        self.instantiate(name, config=obj_config)
+
+    def _refresh_child(self, name):
+        """
+        Reads one object from the product into the dictionary.  Returns the
+        object, or None if the product doesn't have it.
+        """
+        try:
+            self._populate_child(name)
+        except Exception:
+            return None
+        return dict.get(self, name)
+
+    def create_async(self, name, *args, **kwargs):
+        return worker_pool.submit(self.create, name, *args, **kwargs)
+
+    def get_async(self, name):
+        return worker_pool.submit(self.get, name)
+
+    def list_async(self):
+        return worker_pool.submit(self.list)
+
+    def delete_async(self, name):
+        return worker_pool.submit(self.delete, name)
+
+    def suppress_unchanged_writes(self, ttl):
+        """
+        Makes create() skip writes whose body matches the last body
+        written for the same name less than ttl seconds ago.  Records are
+        kept per process, so this is only safe while nothing else changes
+        the product's configuration.
+        """
+        self.write_record_ttl = ttl
+
+    def forget_writes(self, name=None):
+        """
+        Discards the record of the last body written for an object (or for
+        all objects), e.g. because it was changed outside this list.
+        """
+        with self._write_lock:
+            if name is None:
+                self._write_records = {}
+            else:
+                self._write_records.pop(name, None)
+
+    def create(self, name, force=False, **kwargs):
         """
         Creates a new top-level configuration object in the dictionary
-        and on the product.
+        and on the product.  Unless force is set, an unchanged object is
+        not re-sent if write suppression is enabled.
         """
         new_object = self.object_class(name, **kwargs)
         try:
@@ -165,9 +798,48 @@ class ConfigObjectList(dict):
         except AttributeError:
             pass
         self.instantiate(name, obj=new_object)
-        self.connector(name, "PUT", str(self[name]))
+        digest = None
+        if self.write_record_ttl is not None:
+            digest = sha1(
+                json.dumps(new_object.to_dict(), sort_keys=True)
+            ).hexdigest()
+            with self._write_lock:
+                record = self._write_records.get(name)
+                unchanged = not force and isinstance(record, tuple) \
+                    and record[0] == digest \
+                    and time() - record[1] < self.write_record_ttl
+                if unchanged:
+                    self.suppressed_writes += 1
+                else:
+                    # Stands in for the record while the PUT is in flight;
+                    # forget_writes() removing it means the body is stale
+                    pending = self._write_records[name] = object()
+            if unchanged:
+                new_object.mark_clean()
+                return new_object
+        else:
+            self.forget_writes(name)
+        try:
+            self.connector(name, "PUT", str(new_object))
+        except Exception:
+            if digest is not None:
+                self._settle_write(name, pending, None)
+            raise
+        if digest is not None:
+            self._settle_write(name, pending, (digest, time()))
+        new_object.mark_clean()
         return new_object
 
+    def _settle_write(self, name, pending, record):
+        # Replaces a pending write record, unless it has been forgotten
+        with self._write_lock:
+            if self._write_records.get(name) is not pending:
+                return
+            if record is None:
+                del self._write_records[name]
+            else:
+                self._write_records[name] = record
+
     def instantiate(self, name, obj=None, config=None):
         """
         Creates a new top-level configuration object in the dictionary.
@@ -181,28 +853,107 @@ class ConfigObjectList(dict):
                 pass
         elif config:
             new_object = self.object_class(name, config=config)
+            new_object.mark_clean()
         else:
             raise Exception("No configuration supplied to instantiate.")
         self[name] = new_object
 
         def obj_connector(method, data=None, headers=None):
+            if method != "GET":
+                self.forget_writes(name)
             return self.connector(name, method, data, headers)
-        self[name].connector = obj_connector
-        self[name]._parent_list = self
+        new_object.connector = obj_connector
+        new_object._parent_list = self
+
+    def add_index(self, attribute):
+        """
+        Indexes the objects by the value of an attribute.
+        """
+        self._indexes[attribute] = {}
+        for name, obj in dict.iteritems(self):
+            self._index_attributes(name, obj, [attribute])
+
+    def reindex(self, name):
+        """
+        Updates the indexes for an object whose attributes have changed.
+        """
+        if self._indexes and dict.__contains__(self, name):
+            self._unindex_attributes(name)
+            self._index_attributes(name, dict.__getitem__(self, name))
+
+    def _index_attributes(self, name, obj, attributes=None):
+        keys = self._indexed_keys.setdefault(name, {})
+        values = obj._index_values(attributes or list(self._indexes))
+        for attribute, value in values.iteritems():
+            try:
+                attribute_keys = _index_keys(value)
+            except TypeError:
+                continue
+            index = self._indexes[attribute]
+            for key in attribute_keys:
+                index.setdefault(key, set()).add(name)
+            keys[attribute] = attribute_keys
+
+    def _unindex_attributes(self, name):
+        for attribute, keys in self._indexed_keys.pop(name, {}).iteritems():
+            index = self._indexes[attribute]
+            for key in keys:
+                names = index.get(key)
+                if names is not None:
+                    names.discard(name)
+                    if not names:
+                        del index[key]
+
+    def __setitem__(self, name, obj):
+        if self._indexes:
+            self._unindex_attributes(name)
+            dict.__setitem__(self, name, obj)
+            self._index_attributes(name, obj)
+        else:
+            dict.__setitem__(self, name, obj)
+
+    def __delitem__(self, name):
+        dict.__delitem__(self, name)
+        if self._indexes:
+            self._unindex_attributes(name)
 
     def search(self, **kwargs):
+        """
+        Gets the objects whose attributes equal all the given values.
+        Indexed attributes narrow down the candidates, smallest match
+        first (a list value narrows by each of its elements); every
+        criterion is then checked against each candidate.
+        """
         if not self.initialized:
             raise NotImplementedError(
                 "search() not implemented for uninitialized products"
             )
-        results = []
-        for name, item in self.iteritems():
-            for attr, value in kwargs.iteritems():
+        self.materialize()
+        matches = []
+        for attr, value in kwargs.iteritems():
+            if self._indexes and attr in self._indexes:
                 try:
-                    if getattr(item, attr) == value:
-                        results.append(item)
-                except AttributeError:
-                    pass
+                    keys = _index_keys(value)
+                except TypeError:
+                    continue
+                index = self._indexes[attr]
+                matches.extend(index.get(key, set()) for key in keys)
+        if matches:
+            matches.sort(key=len)
+            candidates = [
+                dict.__getitem__(self, name)
+                for name in matches[0].intersection(*matches[1:])
+            ]
+        else:
+            candidates = dict.itervalues(self)
+        results = []
+        for item in candidates:
+            try:
+                if all(getattr(item, attr) == value
+                       for attr, value in kwargs.iteritems()):
+                    results.append(item)
+            except AttributeError:
+                pass
         return results
 
     def get(self, name):
@@ -214,9 +965,12 @@ class ConfigObjectList(dict):
         else:
             try:
                 def obj_connector(method, data=None, headers=None):
+                    if method != "GET":
+                        self.forget_writes(name)
                     return self.connector(name, method, data, headers)
                 obj = self.object_class(name, config=self.connector(name))
                 obj.connector = obj_connector
+                obj.mark_clean()
                 return obj
             except Exception:
                 return None
@@ -232,12 +986,12 @@ class ConfigObjectList(dict):
 
     def __getattr__(self, name):
         def child_function_wrapper(*args):
-            try:
-                child = self[args[0]] \
-                        if self.initialized else self.get(args[0])
-                if child is None:
-                    raise KeyError()
-            except KeyError:
+            child = self.get(args[0])
+            if child is None and self.initialized:
+                # It may have been created through another connection
+                # since the list was loaded
+                child = self._refresh_child(args[0])
+            if child is None:
                 raise Exception("Item %s does not exist" % args[0])
             if hasattr(child, name):
                 child_function = getattr(child, name)
@@ -248,6 +1002,20 @@ class ConfigObjectList(dict):
         return child_function_wrapper
 
 
+def _materializing(name):
+    method = getattr(dict, name)
+
+    def wrapper(self, *args):
+        self.materialize()
+        return method(self, *args)
+    wrapper.__name__ = name
+    return wrapper
+
+for _name in ["__contains__", "__getitem__", "__iter__", "__len__", "items",
+              "iteritems", "iterkeys", "itervalues", "keys", "values"]:
+    setattr(ConfigObjectList, _name, _materializing(_name))
+
+
 class SubList(ConfigObjectList):
 
     def __init__(self, object_class, parent):
@@ -256,7 +1024,7 @@ class SubList(ConfigObjectList):
 
     def create(self, name, *args, **kwargs):
         self.instantiate(name, *args, **kwargs)
-        self.parent.connector("PUT", str(self.parent))
+        self.parent.update()
 
     def instantiate(self, name, *args, **kwargs):
         new_object = self.object_class(name, *args, **kwargs)
@@ -265,10 +1033,10 @@ class SubList(ConfigObjectList):
 
     def delete(self, name):
         del self[name]
-        self.parent.connector("PUT", str(self.parent))
+        self.parent.update()
 
     def update(self):
-        self.parent.connector("PUT", str(self.parent))
+        self.parent.update()
 
 
 ###############################################################################
@@ -282,13 +1050,15 @@ class ProductInstance(ConfigObject):
     __metadata__ = ABCMeta
 
     def __init__(self, url, username, password, list_class, initialize_config,
-                 connectivity_test_url=None):
+                 connectivity_test_url=None, populate_concurrency=1,
+                 prefetch=None):
         self.instance_url = url
         self.connectivity_test_url = connectivity_test_url or url
-        # Initialize HTTP connection object
-        self.http_session = requests.Session()
-        self.http_session.verify = False
-        self.http_session.auth = (username, password)
+        # Get the shared HTTP connection pool for this endpoint
+        self.http_session = http_sessions.acquire(url, username, password)
+        self._session_released = False
+        self._request_observers = [metrics.record_request]
+        self._hedge_replicas = []
 
         # Initialize configuration objects that exist in sets:
         #    i.e. everything in self.config_classes!
@@ -306,9 +1076,128 @@ class ProductInstance(ConfigObject):
                 getattr(self, props['name'])
             )
             obj_lists.append(getattr(self, props['name']))
+        self._config_lists = obj_lists
+        # Lists are only fetched when first used, or when prefetched
         if initialize_config:
             for obj_list in obj_lists:
-                obj_list.populate_from_instance()
+                obj_list.populate_lazily(populate_concurrency)
+            if prefetch:
+                self.prefetch(prefetch)
+
+    @property
+    def suppressed_writes(self):
+        """
+        Number of unchanged writes skipped across all configuration lists.
+        """
+        return sum(
+            obj_list.suppressed_writes for obj_list in self._config_lists
+        )
+
+    @property
+    def populate_timings(self):
+        """
+        Per-class timings of the lists loaded so far, as
+        {class_name: {"objects": count, "seconds": time spent loading}}.
+        """
+        return {
+            cls: getattr(self, props['name']).populate_timing
+            for cls, props in self.config_classes.iteritems()
+            if getattr(self, props['name']).populate_timing is not None
+        }
+
+    def memory_usage(self):
+        """
+        Gets the approximate memory held by each configuration list, as
+        {class_name: ConfigObjectList.memory_usage()}.
+        """
+        return {
+            cls: getattr(self, props['name']).memory_usage()
+            for cls, props in self.config_classes.iteritems()
+        }
+
+    def prefetch(self, list_names=None):
+        """
+        Loads the named configuration object lists (default: all of them)
+        in a background thread.  Returns a Future.
+        """
+        future = Future()
+        if list_names is None:
+            obj_lists = self._config_lists
+        else:
+            obj_lists = [getattr(self, name) for name in list_names]
+
+        def load():
+            try:
+                for obj_list in obj_lists:
+                    obj_list.materialize()
+                future.set_result(None)
+            except Exception:
+                future.set_exception(sys.exc_info())
+        thread = Thread(target=load)
+        thread.daemon = True
+        thread.start()
+        return future
+
+    def populate_from_instance(self, concurrency=1):
+        """
+        Loads every configuration object list that hasn't been loaded yet,
+        fetching up to concurrency objects at a time across all lists.
+        Each list's load lock is held meanwhile, so this and a concurrent
+        materialize() never both load the same list.
+        """
+        lists = [
+            (cls, getattr(self, props['name']))
+            for cls, props in self.config_classes.iteritems()
+        ]
+        # Always taken in config_classes order
+        for cls, obj_list in lists:
+            obj_list._load_lock.acquire()
+        try:
+            self._populate_lists([
+                (cls, obj_list) for cls, obj_list in lists
+                if obj_list.populate_timing is None
+            ], concurrency)
+        finally:
+            for cls, obj_list in lists:
+                obj_list._load_lock.release()
+
+    def _populate_lists(self, lists, concurrency):
+        lock = Lock()
+        timings = {}
+
+        def list_children((cls, obj_list)):
+            start_time = time()
+            names = obj_list._child_names()
+            with lock:
+                timings[cls] = {
+                    "objects": len(names), "seconds": time() - start_time
+                }
+            return names
+        child_names = worker_pool.map(list_children, lists, concurrency)
+
+        def populate_child((cls, obj_list, name)):
+            start_time = time()
+            obj_list._populate_child(name)
+            with lock:
+                timings[cls]['seconds'] += time() - start_time
+        worker_pool.map(populate_child, [
+            (cls, obj_list, name)
+            for (cls, obj_list), names in zip(lists, child_names)
+            for name in names
+        ], concurrency)
+        for cls, obj_list in lists:
+            obj_list.populate_timing = timings[cls]
+            obj_list._lazy_concurrency = None
+
+    def populate_from_instance_async(self):
+        """
+        Loads every configuration object list concurrently.  Returns a
+        Future.
+        """
+        return gather([
+            obj_list.populate_from_instance_async()
+            for obj_list in self._config_lists
+        ])
 
     def get_object_connector(self, cls, path):
         """
@@ -328,7 +1217,6 @@ class ProductInstance(ConfigObject):
             req_headers = {"Content-Type": "application/json"}
 
         def connector(name=None, method="GET", data=None, headers=None):
-            http_func = getattr(self.http_session, method.lower())
             url = "%s/%s" % (self.instance_url, path)
             if name:
                 url = "%s/%s" % (url, quote(name))
@@ -342,30 +1230,181 @@ class ProductInstance(ConfigObject):
                 pass
             if headers:
                 req_headers.update(headers)
+            if method == "GET" and self._hedge_replicas:
+                response = self._hedged_get(url, req_headers)
+            else:
+                response = self._send(method, url, data, req_headers)
+            return response.text
+        return connector
+
+    def enable_hedging(self, replica_urls, percentile=95, min_delay=0.05):
+        """
+        Sends GETs that are slower than the given percentile of recent GET
+        latencies (but at least min_delay seconds) to the next replica as
+        well, and uses whichever response arrives first.  replica_urls are
+        equivalents of instance_url on other Services Directors.
+        """
+        self._hedge_replicas = list(replica_urls)
+        self._hedge_percentile = percentile
+        self._hedge_min_delay = min_delay
+        self._get_latencies = deque(maxlen=200)
+
+    def _send(self, method, url, data, headers):
+        if url.startswith(self.instance_url):
+            session = self.http_session
+        else:
+            username, password = self.http_session.auth
+            session = http_sessions.get_session(url, username, password)
+        http_func = getattr(session, method.lower())
+        path = metrics.path_template(self.instance_url, url)
+        with tracer.span("%s %s" % (method, path), url=url) as span:
+            start_time = time()
             try:
                 response = http_func(
                     url,
                     data=data,
-                    headers=req_headers
+                    headers=headers,
+                    timeout=http_sessions.timeout
                 )
             except Exception as e:
-                raise Exception(
+                elapsed = time() - start_time
+                self._notify_request_observers(
+                    method, url, elapsed, None, len(data or "")
+                )
+                slow_log.record(
+                    self.__class__.__name__, method, path, None, elapsed,
+                    data
+                )
+                raise RESTError(
                     "Exception '%s' making HTTP request...\nMethod: %s\n"
                     "URL: %s\nHeaders: %s\nBody: %s" % (
-                        str(e), method, url, req_headers, data
+                        str(e), method, url, headers, data
                     )
-            )
-            if not 200 <= response.status_code < 300:
-                raise Exception(
-                    "Invalid HTTP response %s from %s request to %s: %s" % (
-                        response.status_code, method, url, response.text
-                    ))
-            return response.text
-        return connector
+                )
+            elapsed = time() - start_time
+            span.set("status", response.status_code)
+        self._notify_request_observers(
+            method, url, elapsed, response.status_code, len(data or ""),
+            len(response.content)
+        )
+        slow_log.record(
+            self.__class__.__name__, method, path, response.status_code,
+            elapsed, data, len(response.content)
+        )
+        if not 200 <= response.status_code < 300:
+            raise RESTError(
+                "Invalid HTTP response %s from %s request to %s: %s" % (
+                    response.status_code, method, url, response.text
+                ), response.status_code)
+        if method == "GET" and self._hedge_replicas:
+            self._get_latencies.append(elapsed)
+        return response
+
+    def _hedged_get(self, url, headers):
+        path = url[len(self.instance_url):]
+        targets = [url] + [replica + path for replica in self._hedge_replicas]
+        delay = self._hedge_delay()
+        results = Queue()
+
+        def fetch(target):
+            try:
+                results.put((True, self._send("GET", target, None, headers)))
+            except Exception:
+                results.put((False, sys.exc_info()))
+
+        def outcome(success, value):
+            # An HTTP error response is a definitive answer; only transport
+            # errors and server errors are worth trying elsewhere.
+            if success:
+                return value
+            status_code = getattr(value[1], "status_code", None)
+            if status_code is not None and status_code < 500:
+                raise value[0], value[1], value[2]
+            return None
+
+        pending = 0
+        error = None
+        for index, target in enumerate(targets):
+            thread = Thread(target=tracer.bind(fetch), args=(target,))
+            thread.daemon = True
+            thread.start()
+            pending += 1
+            last = index == len(targets) - 1
+            try:
+                success, value = results.get(timeout=None if last else delay)
+            except Empty:
+                continue  # Too slow; race the next replica
+            pending -= 1
+            response = outcome(success, value)
+            if response is not None:
+                return response
+            error = value
+        while pending:
+            success, value = results.get()
+            pending -= 1
+            response = outcome(success, value)
+            if response is not None:
+                return response
+            error = value
+        raise error[0], error[1], error[2]
+
+    def _hedge_delay(self):
+        if len(self._get_latencies) < 20:
+            # Too few samples yet; only hedge requests that look stuck
+            return max(self._hedge_min_delay, 1.0)
+        latencies = sorted(self._get_latencies)
+        index = min(
+            len(latencies) - 1,
+            int(len(latencies) * self._hedge_percentile / 100.0)
+        )
+        return max(self._hedge_min_delay, latencies[index])
+
+    def add_request_observer(self, observer):
+        """
+        Registers a callable to be told about every request made through
+        this instance's connectors.  It is called with the instance, the
+        HTTP method, the URL, the elapsed time in seconds, the response
+        status code (None if no response was received) and the sizes in
+        bytes of the request and response bodies.
+        """
+        self._request_observers.append(observer)
+
+    def _notify_request_observers(self, method, url, elapsed, status,
+                                  request_bytes=0, response_bytes=0):
+        for observer in self._request_observers:
+            try:
+                observer(
+                    self, method, url, elapsed, status, request_bytes,
+                    response_bytes
+                )
+            except Exception:
+                pass
+
+    def prewarm_connections(self, connections=1):
+        """
+        Opens pooled connections to the instance in the background.
+        """
+        username, password = self.http_session.auth
+        http_sessions.prewarm(
+            self.connectivity_test_url, username, password, connections
+        )
+
+    def close(self):
+        """
+        Releases the instance's use of its pooled HTTP session.  The
+        instance should not be used afterwards.
+        """
+        if self._session_released:
+            return
+        self._session_released = True
+        username, password = self.http_session.auth
+        http_sessions.release(self.instance_url, username, password)
 
     def test_connectivity(self):
         try:
-            response = self.http_session.get(self.connectivity_test_url)
+            response = self.http_session.get(
+                self.connectivity_test_url, timeout=http_sessions.timeout
+            )
         except Exception as e:
             return False
         if response.status_code == 200:
@@ -17,10 +17,19 @@
 # Matthew Geldert (mgeldert@brocade.com), Brocade Communications Systems,Inc.
 #
 
+from abstract_product import http_sessions, worker_pool
+import json
+from memory import memory_tracker
+from metrics import registry as metrics_registry
 from neutron_lbaas.common.cert_manager import _CERT_MANAGER_PLUGIN
 from neutron_lbaas.common.tls_utils.cert_parser import get_host_names
 from oslo_config import cfg
 from oslo_log import log as logging
+from profiler import profiler
+from retry import RetryPolicy, wait_recorder
+from slow_log import JSONLinesSink, slow_log
+from stats_collector import StatsCollector
+from tracing import DiscardExporter, load_exporter, tracer
 
 LOG = logging.getLogger(__name__)
 certificate_manager = _CERT_MANAGER_PLUGIN.CertManager
@@ -77,13 +86,16 @@ class vTMDeviceDriverCommon(object):
             }
         }}
         vserver_config['properties']['basic'].update(listen_on_settings)
+        changes = vtm.change_set()
         # Configure SSL termination...
         if listener.protocol == "TERMINATED_HTTPS":
             if cfg.CONF.lbaas_settings.https_offload is False:
                 raise Exception("HTTPS termination has been disabled by "
                                 "the administrator")
             # Get cert from Barbican and upload to vTM
-            self._upload_certificate(vtm, listener.default_tls_container_id)
+            self._upload_certificate(
+                vtm, listener.default_tls_container_id, changes
+            )
             # certificate and initialize the SNI mapping table
             vserver_config['properties']['basic']['ssl_decrypt'] = True
             vserver_config['properties']['ssl'] = {
@@ -94,7 +106,7 @@ class vTMDeviceDriverCommon(object):
                 for sni_container in listener.sni_containers:
                     # Get cert from Barbican and upload to vTM
                     cert = self._upload_certificate(
-                        vtm, sni_container.tls_container_id
+                        vtm, sni_container.tls_container_id, changes
                     )
                     # Get CN and subjectAltNames from certificate
                     cert_hostnames = get_host_names(cert.get_certificate())
@@ -123,25 +135,24 @@ class vTMDeviceDriverCommon(object):
         # Configure connection limiting...
         if listener.connection_limit < 1:
             # Delete existing connection limiting settings if not required...
-            if vtm.rate_class.get(listener.id):
-                vtm.rate_class.delete(listener.id)
-            if vtm.rule.get("rate-%s" % listener.id):
-                vtm.rule.delete("rate-%s" % listener.id)
+            changes.delete("rate_class", listener.id)
+            changes.delete("rule", "rate-%s" % listener.id)
             vserver_config['properties']['basic']['request_rules'] = []
         elif old is None or old.connection_limit != listener.connection_limit:
             # Create connection limiting settings if required
-            vtm.rate_class.create(
-                listener.id,
+            changes.create(
+                "rate_class", listener.id,
                 max_rate_per_second=listener.connection_limit
             )
-            vtm.rule.create(
-                "rate-%s" % listener.id,
+            changes.create(
+                "rule", "rate-%s" % listener.id,
                 rule_text='rate.use("%s");' % listener.id
             )
             vserver_config['properties']['basic']['request_rules'] = \
                 ["rate-%s" % listener.id]
         # Create/update virtual server...
-        vtm.vserver.create(listener.id, config=vserver_config)
+        changes.create("vserver", listener.id, config=vserver_config)
+        changes.apply()
         # Modify Neutron security group to allow access to data port...
         if use_security_group:
             if not old or old.protocol_port != listener.protocol_port:
@@ -155,9 +166,9 @@ class vTMDeviceDriverCommon(object):
                     )
 
     def delete_listener(self, listener, vtm, use_security_group=True):
-        vs = vtm.vserver.get(listener.id)
+        changes = vtm.change_set()
         # Delete Virtual Server
-        vs.delete()
+        changes.delete("vserver", listener.id)
         # Delete associated SSL certificates if not still in use
         if listener.protocol == "TERMINATED_HTTPS":
             try:
@@ -168,6 +179,8 @@ class vTMDeviceDriverCommon(object):
             for container in tls_containers:
                 cert_in_use = False
                 for vserver in vtm.vservers.list():
+                    if vserver == listener.id:
+                        continue
                     vs = vtm.vserver.get(vserver)
                     if vs.ssl__server_cert_default == container:
                         cert_in_use = True
@@ -175,11 +188,12 @@ class vTMDeviceDriverCommon(object):
                         if mapping['certificate'] == container:
                             cert_in_use = True
                 if cert_in_use is False:
-                    vtm.ssl_server_cert.delete(container)
+                    changes.delete("ssl_server_cert", container)
         # Clean up vTM connection-limiting config objects
         if listener.connection_limit > 0:
-            vtm.rules.delete("rate-%s" % listener.id)
-            vtm.rate_class.delete(listener.id)
+            changes.delete("rule", "rate-%s" % listener.id)
+            changes.delete("rate_class", listener.id)
+        changes.apply()
         if use_security_group:
             # Delete security group rule for the listener port/protocol
             protocol = 'udp' if listener.protocol == "UDP" else 'tcp'
@@ -195,6 +209,7 @@ class vTMDeviceDriverCommon(object):
         self.update_pool(pool, None)
 
     def update_pool(self, pool, old, vtm, note=None):
+        changes = vtm.change_set()
         pool_config = {"properties": {
             "basic": {
                 "monitors": [],
@@ -224,8 +239,8 @@ class vTMDeviceDriverCommon(object):
             # vTM has no source IP LB algorithm, so simulate it with
             # round-robin loadbalancing and source IP session persistence
             persistence_config = {"properties": {"basic": {"type": "ip"}}}
-            vtm.persistence_class.create(
-                pool.id, config=persistence_config
+            changes.create(
+                "persistence_class", pool.id, config=persistence_config
             )
             pool_config['properties']['basic']['persistence_class'] = pool.id
         elif pool.sessionpersistence:
@@ -238,35 +253,38 @@ class vTMDeviceDriverCommon(object):
             if pool.sessionpersistence.type == "APP_COOKIE":
                 persistence_config['properties']['basic']['cookie'] = \
                     pool.sessionpersistence.cookie_name
-            vtm.persistence_class.create(
-                pool.id, config=persistence_config
+            changes.create(
+                "persistence_class", pool.id, config=persistence_config
             )
             pool_config['properties']['basic']['persistence_class'] = pool.id
         else:
             pool_config['properties']['basic']['persistence_class'] = ""
         # Create pool...
-        vtm.pool.create(pool.id, config=pool_config)
+        changes.create("pool", pool.id, config=pool_config)
         # Update vserver default pool if it's 'discard'
         vs = vtm.vserver.get(pool.listener.id)
         if vs.pool == 'discard':
             vs.pool = pool.id
-            vs.update()
+            changes.update("vserver", vs)
         # Tidy up obsolete persistence class if present
         if old is not None and old.sessionpersistence \
             and not pool.sessionpersistence:
-            vtm.persistence_class.delete(pool.id)
+            changes.delete("persistence_class", pool.id)
+        changes.apply()
 
     def delete_pool(self, pool, vtm):
+        changes = vtm.change_set()
         # Reset VS default pool if == this pool
         vs = vtm.vserver.get(pool.listener.id)
         if vs.pool == pool.id:
             vs.pool = 'discard'
-            vs.update()
+            changes.update("vserver", vs)
         # Delete the pool itelf
-        vtm.pool.delete(pool.id)
+        changes.delete("pool", pool.id)
         # Delete any associated persistence classes
         if pool.sessionpersistence:
-            vtm.persistence_class.delete(pool.id)
+            changes.delete("persistence_class", pool.id)
+        changes.apply()
 
 ###########
 # MEMBERS #
@@ -333,45 +351,82 @@ class vTMDeviceDriverCommon(object):
                 "status_regex": self._codes_to_regex(monitor.expected_codes)
             }
         }}
+        changes = vtm.change_set()
         # Create/update the vTM health monitor object
-        vtm.monitor.create(monitor.id, config=monitor_config)
+        changes.create("monitor", monitor.id, config=monitor_config)
         # Update the vTM pool to use the monitor
         sa_pool = vtm.pool.get(monitor.pool.id)
         sa_pool.monitors = [monitor.id]
-        sa_pool.update()
+        changes.update("pool", sa_pool)
+        changes.apply()
 
     def delete_healthmonitor(self, monitor, vtm):
-        # Delete the vTM health monitor object
-        vtm.monitor.delete(monitor.id)
+        changes = vtm.change_set()
+        # Delete the vTM health monitor object (once the pool no longer
+        # refers to it)
+        changes.delete("monitor", monitor.id)
         # Update the vTM pool to remove the monitor
         if monitor.pool:
             sa_pool = vtm.pool.get(monitor.pool.id)
             sa_pool.monitors = []
-            sa_pool.update()
+            changes.update("pool", sa_pool)
+        changes.apply()
 
 #########
 # STATS #
 #########
 
-    def stats(self, vtm, listen_ip=None):
-        if listen_ip:
-            stats = vtm.statistics.listen_ips[listen_ip]
-            bytes_in = stats.bytes_in
-            bytes_out = stats.bytes_out
-            active_conns = stats.current_conn
+    def stats(self, target, get_vtm, listen_ip=None):
+        """
+        Gets the statistics of listen_ip (or of the whole vTM) from the
+        background collector; get_vtm is only called if they have not been
+        collected yet.
+        """
+        if self.stats_collector is None:
+            stats = StatsCollector.fetch(get_vtm(), listen_ip)
         else:
-            stats = vtm.statistics.globals
-            bytes_in = stats.total_bytes_in
-            bytes_out = stats.total_bytes_out
-            active_conns = stats.total_current_conn
-        total_conns = stats.total_conn
+            stats = self.stats_collector.get(target, get_vtm, listen_ip)
+        return StatsCollector.counters(stats, listen_ip)
+
+    def stats_rates(self, loadbalancer, window=None):
+        """
+        Gets bytes/s and connections/s of a loadbalancer, and its average
+        number of active connections, over the statistics collected in the
+        last window seconds (or all that are kept).  Returns None until two
+        samples have been collected, or if collection is disabled.
+        """
+        if self.stats_collector is None:
+            return None
+        return self.stats_collector.rates(
+            *self._stats_source(loadbalancer), window=window
+        )
+
+###############
+# DIAGNOSTICS #
+###############
+
+    def memory_report(self):
+        """
+        Gets the approximate memory held by the configuration of each vTM
+        and Services Director the driver has loaded, per object class, and
+        the memory changes recorded around recent driver operations (if
+        profiling_settings.memory_diffs is set).
+        """
         return {
-            "bytes_in": bytes_in,
-            "bytes_out": bytes_out,
-            "active_connections": active_conns,
-            "total_connections": total_conns
+            "instances": {
+                instance.instance_url: instance.memory_usage()
+                for instance in self._product_instances()
+            },
+            "operations": memory_tracker.diffs()
         }
 
+    def retry_report(self):
+        """
+        Gets the number of waits between retries, the total seconds waited
+        and the longest wait at each retry site since the driver started.
+        """
+        return wait_recorder.summary()
+
 ###########
 # REFRESH #
 ###########
@@ -402,10 +457,106 @@ class vTMDeviceDriverCommon(object):
             ]
         )
 
+    def _configure_http_sessions(self):
+        http_sessions.configure(
+            pool_connections=cfg.CONF.http_settings.pool_connections,
+            pool_maxsize=cfg.CONF.http_settings.pool_maxsize,
+            pool_block=cfg.CONF.http_settings.pool_block,
+            connect_timeout=cfg.CONF.http_settings.connect_timeout,
+            read_timeout=cfg.CONF.http_settings.read_timeout
+        )
+        worker_pool.resize(cfg.CONF.http_settings.max_concurrent_requests)
+
+    def _retry_policy(self, site):
+        return RetryPolicy.from_config(
+            site, getattr(cfg.CONF.retry_settings, site)
+        )
+
+    def _vtm_cache_settings(self):
+        return {
+            "mirror_config": cfg.CONF.vtm_settings.config_mirror,
+            "mirror_ttl": cfg.CONF.vtm_settings.config_mirror_ttl or None,
+            "write_suppression_ttl": (
+                cfg.CONF.vtm_settings.unchanged_write_ttl or None
+            )
+        }
+
+    def _start_metrics_export(self):
+        # Metrics are only recorded once something will export them
+        if cfg.CONF.metrics_settings.file:
+            metrics_registry.export_to_file(
+                cfg.CONF.metrics_settings.file,
+                cfg.CONF.metrics_settings.file_interval
+            )
+        if cfg.CONF.metrics_settings.listen_port:
+            metrics_registry.serve(
+                cfg.CONF.metrics_settings.listen_address,
+                cfg.CONF.metrics_settings.listen_port
+            )
+
+    def _start_tracing(self):
+        if cfg.CONF.tracing_settings.exporter:
+            tracer.exporter = load_exporter(
+                cfg.CONF.tracing_settings.exporter,
+                cfg.CONF.tracing_settings.file
+            )
+
+    def _start_slow_log(self):
+        if not cfg.CONF.slow_log_settings.threshold:
+            return
+        if cfg.CONF.slow_log_settings.file:
+            sink = JSONLinesSink(cfg.CONF.slow_log_settings.file)
+        else:
+            def sink(entry):
+                LOG.warning(_("\nSlow request: %s" % json.dumps(entry)))
+        slow_log.configure(cfg.CONF.slow_log_settings.threshold, sink)
+        if not tracer.enabled:
+            # Entries are attributed to operations through the trace context
+            tracer.exporter = DiscardExporter()
+
+    def _start_profiling(self):
+        profiler.configure(
+            cfg.CONF.profiling_settings.sample_rate,
+            cfg.CONF.profiling_settings.interval,
+            cfg.CONF.profiling_settings.directory
+        )
+        memory_tracker.configure(
+            cfg.CONF.profiling_settings.memory_diffs,
+            cfg.CONF.profiling_settings.memory_diff_top
+        )
+
+    def _start_stats_collector(self):
+        # With no collection interval, stats() reads the vTM every time
+        self.stats_collector = None
+        if cfg.CONF.vtm_settings.stats_interval > 0:
+            self.stats_collector = StatsCollector(
+                cfg.CONF.vtm_settings.stats_max_age,
+                cfg.CONF.http_settings.populate_concurrency,
+                cfg.CONF.vtm_settings.stats_samples
+            )
+            self.stats_collector.start(cfg.CONF.vtm_settings.stats_interval)
+
+    def _log_populate_timings(self, instance):
+        timings = sorted(
+            instance.populate_timings.iteritems(),
+            key=lambda (cls, timing): timing['seconds'], reverse=True
+        )
+        for cls, timing in timings:
+            LOG.debug(_("\nLoaded %s %s objects from %s in %.2fs" % (
+                timing['objects'], cls, instance.instance_url,
+                timing['seconds']
+            )))
+
+    def _prewarm_connections(self, instances):
+        connections = cfg.CONF.http_settings.prewarm_connections
+        if connections > 0:
+            for instance in instances:
+                instance.prewarm_connections(connections)
+
     def _get_hostname(self, id):
         return "vtm-%s" % (id)
 
-    def _upload_certificate(self, vtm, container_id):
+    def _upload_certificate(self, vtm, container_id, changes=None):
         # Get the certificate from Barbican
         cert = certificate_manager.get_cert(
             container_id, service_name="Neutron LBaaS v2 Brocade provider"
@@ -421,8 +572,15 @@ class vTMDeviceDriverCommon(object):
             cert_chain = cert.get_certificate() + cert.get_intermediates()
         except TypeError:
             cert_chain = cert.get_certificate()
-        # Upload the certificate and key to the vTM
-        vtm.ssl_server_cert.create(
-            container_id, private=cert.get_private_key(), public=cert_chain
-        )
+        # Upload the certificate and key to the vTM (or queue the upload)
+        if changes is not None:
+            changes.create(
+                "ssl_server_cert", container_id,
+                private=cert.get_private_key(), public=cert_chain
+            )
+        else:
+            vtm.ssl_server_cert.create(
+                container_id, private=cert.get_private_key(),
+                public=cert_chain
+            )
         return cert
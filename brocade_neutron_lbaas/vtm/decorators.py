@@ -0,0 +1,35 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Brocade Communications Systems, Inc.  All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+
+def wrap_public_methods(cls, marker, make_wrapper):
+    """
+    Replaces every public method of cls, including inherited ones, with
+    make_wrapper(name, func), and sets the marker attribute on each wrapper.
+    Methods already marked, e.g. because a base class was decorated the
+    same way, are left alone.
+    """
+    for name in dir(cls):
+        if name.startswith("_"):
+            continue
+        func = getattr(getattr(cls, name), "im_func", None)
+        if func is None or getattr(func, marker, False):
+            continue
+        wrapper = make_wrapper(name, func)
+        setattr(wrapper, marker, True)
+        setattr(cls, name, wrapper)
+    return cls
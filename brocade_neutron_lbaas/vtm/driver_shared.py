@@ -18,17 +18,24 @@
 #
 
 from common_driver import vTMDeviceDriverCommon
+from health import HealthTracker
+from memory import memory_tracked
+from metrics import instrumented
 from neutron_lbaas.common.exceptions import LbaasException
 from openstack_connector import OpenStackInterface
 from oslo_config import cfg
 from oslo_log import log as logging
+from profiler import profiled
+from threading import Lock
 from vtm import vTM
-from time import sleep
 from traceback import format_exc
 
 LOG = logging.getLogger(__name__)
 
 
+@instrumented("driver")
+@profiled
+@memory_tracked
 class BrocadeAdxDeviceDriverV2(vTMDeviceDriverCommon):
     """
     Shared vTM Cluster Version
@@ -36,6 +43,11 @@ class BrocadeAdxDeviceDriverV2(vTMDeviceDriverCommon):
 
     def __init__(self, plugin):
         self.openstack_connector = OpenStackInterface()
+        self._configure_http_sessions()
+        self._start_metrics_export()
+        self._start_tracing()
+        self._start_slow_log()
+        self._start_profiling()
         # Build a list of all vTMs in the cluster
         self.vtms = [
             vTM(
@@ -45,10 +57,23 @@ class BrocadeAdxDeviceDriverV2(vTMDeviceDriverCommon):
                     cfg.CONF.vtm_settings.api_version
                 ),
                 cfg.CONF.vtm_settings.username,
-                cfg.CONF.vtm_settings.password
+                cfg.CONF.vtm_settings.password,
+                **self._vtm_cache_settings()
             )
             for server in cfg.CONF.lbaas_settings.admin_servers
         ]
+        self._last_vtm = None
+        self._last_vtm_lock = Lock()
+        self._prewarm_connections(self.vtms)
+        # Member health is learnt passively from the driver's own requests
+        self.vtm_health = HealthTracker(
+            self.vtms,
+            cfg.CONF.vtm_settings.health_failure_threshold,
+            cfg.CONF.vtm_settings.health_reset_timeout
+        )
+        for vtm in self.vtms:
+            vtm.add_request_observer(self.vtm_health.record_request)
+        self._start_stats_collector()
         LOG.info(
             _("\nShared Brocade vTM LBaaS module initialized with %s " % len(
                 self.vtms
@@ -264,9 +289,8 @@ class BrocadeAdxDeviceDriverV2(vTMDeviceDriverCommon):
     def stats(self, loadbalancer):
         LOG.debug(_("\nstats(%s): called" % loadbalancer.id))
         try:
-            vtm = self._get_vtm()
             return super(BrocadeAdxDeviceDriverV2, self).stats(
-                vtm, loadbalancer.vip_address
+                *self._stats_source(loadbalancer)
             )
         except Exception as e:
             LOG.error(_("\nError in stats(%s): %s" % (loadbalancer.id, e)))
@@ -277,6 +301,14 @@ class BrocadeAdxDeviceDriverV2(vTMDeviceDriverCommon):
 # MISC #
 ########
 
+    def _product_instances(self):
+        return self.vtms
+
+    def _stats_source(self, loadbalancer):
+        # The cluster shares its statistics; each VIP is a listen IP
+        # Reading statistics mustn't discard the configuration mirror
+        return "cluster", self._select_vtm, loadbalancer.vip_address
+
     def _get_tip_group_nodes(self, vtm):
         # Get a tally of how many TIP groups the machine is currently in...
         cluster_members = vtm.get_nodes_in_cluster()
@@ -314,13 +346,26 @@ class BrocadeAdxDeviceDriverV2(vTMDeviceDriverCommon):
         }
 
     def _get_vtm(self):
-        for _ in xrange(3):
-            for vtm in self.vtms:
-                try:
-                    if not vtm.test_connectivity():
-                        raise Exception("")
-                    return vtm
-                except:
-                    pass
-            sleep(3)
-        raise Exception("Could not contact any vTMs in cluster")
+        """
+        Gets the cluster member to configure, discarding its mirrored
+        configuration if the last change was made through another member.
+        """
+        vtm = self._select_vtm()
+        with self._last_vtm_lock:
+            if vtm is not self._last_vtm:
+                # Changes made through the previous member aren't in this
+                # member's mirror
+                vtm.invalidate_mirror()
+                self._last_vtm = vtm
+        return vtm
+
+    def _select_vtm(self):
+        """
+        Gets the healthy cluster member with the lowest observed latency.
+        """
+        def select():
+            vtm = self.vtm_health.select()
+            if vtm is None:
+                raise Exception("Could not contact any vTMs in cluster")
+            return vtm
+        return self._retry_policy("get_vtm").call(select)
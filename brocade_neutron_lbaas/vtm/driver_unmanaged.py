@@ -17,19 +17,85 @@
 # Matthew Geldert (mgeldert@brocade.com), Brocade Communications Systems,Inc.
 #
 
+from collections import OrderedDict
 from common_driver import vTMDeviceDriverCommon
+from health import HealthTracker
+from memory import memory_tracked
+from metrics import instrumented
 from neutron_lbaas.common.exceptions import LbaasException
 from openstack_connector import OpenStackInterface
 from oslo_config import cfg
 from oslo_log import log as logging
+from profiler import profiled
 from services_director import ServicesDirector
 from vtm import vTM
-from time import sleep
+from threading import Lock
+from time import sleep, time
 from traceback import format_exc
+from tracing import traced
 
 LOG = logging.getLogger(__name__)
 
 
+class vTMHandleCache(object):
+    """
+    Bounded LRU cache of live vTM objects, keyed by hostname.
+
+    A cached vTM is returned without a connectivity test until its health
+    TTL expires; after that the next lookup re-tests it and either renews
+    the entry or evicts it.  Evicted and invalidated vTMs are closed, so
+    their share of the pooled HTTP session is released.
+    """
+
+    def __init__(self, max_size, health_ttl):
+        self.max_size = max_size
+        self.health_ttl = health_ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                vtm, checked = self._entries.pop(key)
+            except KeyError:
+                return None
+            self._entries[key] = (vtm, checked)
+        if time() - checked < self.health_ttl:
+            return vtm
+        if vtm.test_connectivity():
+            self.put(key, vtm)
+            return vtm
+        self.invalidate(key)
+        return None
+
+    def put(self, key, vtm):
+        if self.max_size < 1:
+            return
+        evicted = []
+        with self._lock:
+            replaced = self._entries.pop(key, None)
+            if replaced is not None and replaced[0] is not vtm:
+                evicted.append(replaced[0])
+            self._entries[key] = (vtm, time())
+            while len(self._entries) > self.max_size:
+                evicted.append(self._entries.popitem(last=False)[1][0])
+        for old_vtm in evicted:
+            old_vtm.close()
+
+    def invalidate(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is not None:
+            entry[0].close()
+
+    def instances(self):
+        with self._lock:
+            return [vtm for vtm, checked in self._entries.itervalues()]
+
+
+@instrumented("driver")
+@profiled
+@memory_tracked
 class BrocadeAdxDeviceDriverV2(vTMDeviceDriverCommon):
     """
     Services Director Unmanaged Version
@@ -41,6 +107,11 @@ class BrocadeAdxDeviceDriverV2(vTMDeviceDriverCommon):
             services_director_list = cfg.CONF.lbaas_settings.admin_ips
         else:
             services_director_list = cfg.CONF.lbaas_settings.admin_servers
+        self._configure_http_sessions()
+        self._start_metrics_export()
+        self._start_tracing()
+        self._start_slow_log()
+        self._start_profiling()
         self.services_directors = [
             ServicesDirector(
                 "https://%s:%s/api/tmcm/%s" % (
@@ -53,10 +124,37 @@ class BrocadeAdxDeviceDriverV2(vTMDeviceDriverCommon):
                 connectivity_test_url="https://%s:%s/api/tmcm/1.5" % (
                     server,
                     cfg.CONF.services_director_settings.rest_port
+                ),
+                populate_concurrency=(
+                    cfg.CONF.http_settings.populate_concurrency
                 )
             )
             for server in services_director_list
         ]
+        # Load the only list the driver reads in the background
+        for services_director in self.services_directors:
+            services_director.prefetch(["unmanaged_instance"]).then(
+                lambda _, sd=services_director: self._log_populate_timings(sd)
+            )
+        self._prewarm_connections(self.services_directors)
+        for services_director in self.services_directors:
+            self._enable_hedging(services_director, services_director)
+        # Each Services Director caches its own list of instances, so keep
+        # using the same one while it is healthy rather than the fastest
+        self.services_director_health = HealthTracker(
+            self.services_directors,
+            cfg.CONF.services_director_settings.health_failure_threshold,
+            cfg.CONF.services_director_settings.health_reset_timeout,
+            prefer_order=True
+        )
+        self.services_director_health.start(
+            cfg.CONF.services_director_settings.health_check_interval
+        )
+        self.vtm_cache = vTMHandleCache(
+            cfg.CONF.vtm_settings.handle_cache_size,
+            cfg.CONF.vtm_settings.handle_cache_ttl
+        )
+        self._start_stats_collector()
         self.openstack_connector = OpenStackInterface()
         LOG.info(_("\nBrocade vTM LBaaS module initialized."))
 
@@ -315,16 +413,9 @@ class BrocadeAdxDeviceDriverV2(vTMDeviceDriverCommon):
     def stats(self, loadbalancer):
         LOG.debug(_("\nstats(%s): called" % loadbalancer.id))
         try:
-            if self.lb_deployment_model == "PER_TENANT":
-                hostname = self._get_hostname(loadbalancer.tenant_id)
-                vtm = self._get_vtm(hostname)
-                return super(BrocadeAdxDeviceDriverV2, self).stats(
-                    vtm, loadbalancer.vip_address
-                )
-            elif self.lb_deployment_model == "PER_LOADBALANCER":
-                hostname = self._get_hostname(loadbalancer.id)
-                vtm = self._get_vtm(hostname)
-                return super(BrocadeAdxDeviceDriverV2, self).stats(vtm)
+            return super(BrocadeAdxDeviceDriverV2, self).stats(
+                *self._stats_source(loadbalancer)
+            )
         except Exception as e:
             LOG.error(_("\nError in stats(%s): %s" % (loadbalancer.id, e)))
             LOG.error(_("\n%s" % format_exc()))
@@ -334,58 +425,110 @@ class BrocadeAdxDeviceDriverV2(vTMDeviceDriverCommon):
 # MISC #
 ########
 
+    def _product_instances(self):
+        return self.services_directors + self.vtm_cache.instances()
+
+    def _stats_source(self, loadbalancer):
+        # A tenant's vTM serves all its loadbalancers, each on a listen IP
+        if self.lb_deployment_model == "PER_TENANT":
+            hostname = self._get_hostname(loadbalancer.tenant_id)
+            listen_ip = loadbalancer.vip_address
+        elif self.lb_deployment_model == "PER_LOADBALANCER":
+            hostname = self._get_hostname(loadbalancer.id)
+            listen_ip = None
+        return hostname, lambda: self._get_vtm(hostname), listen_ip
+
+    @traced("driver.get_services_director")
     def _get_services_director(self):
         """
         Gets available instance of Brocade Services Director from the cluster.
+        The health tracker probes the Services Directors in the background,
+        so this normally returns immediately.
         """
-        for services_director in self.services_directors:
-            for _ in range(3):
-                if services_director.test_connectivity():
-                    return services_director
-                sleep(2)
-        raise Exception("Could not contact any Services Directors")
+        services_director = self.services_director_health.get_best()
+        if services_director is not None:
+            return services_director
+
+        def reprobe():
+            # All are marked down; re-test them in case one has recovered
+            self.services_director_health.probe_all(force=True)
+            services_director = self.services_director_health.get_best()
+            if services_director is None:
+                raise Exception("Could not contact any Services Directors")
+            return services_director
+        return self._retry_policy("get_services_director").call(reprobe)
 
+    @traced("driver.get_vtm")
     def _get_vtm(self, hostname):
         """
         Gets available instance of Brocade vTM from a Services Director.
         """
+        vtm = self.vtm_cache.get(hostname)
+        if vtm is not None:
+            return vtm
         services_director = self._get_services_director()
         url = "%s/instance/%s/tm/%s" % (
             services_director.instance_url,
             hostname,
             cfg.CONF.vtm_settings.api_version
         )
-        for i in xrange(5):
-            vtm = vTM(
-                url,
-                cfg.CONF.services_director_settings.username,
-                cfg.CONF.services_director_settings.password,
-                connectivity_test_url="%s/instance/%s/tm/%s" % (
-                    services_director.connectivity_test_url,
-                    hostname,
-                    cfg.CONF.vtm_settings.api_version
+        vtm = vTM(
+            url,
+            cfg.CONF.services_director_settings.username,
+            cfg.CONF.services_director_settings.password,
+            connectivity_test_url="%s/instance/%s/tm/%s" % (
+                services_director.connectivity_test_url,
+                hostname,
+                cfg.CONF.vtm_settings.api_version
+            ),
+            **self._vtm_cache_settings()
+        )
+
+        self._enable_hedging(vtm, services_director)
+
+        def connect():
+            if not vtm.test_connectivity():
+                raise Exception("Could not contact vTM instance")
+        try:
+            self._retry_policy("get_vtm").call(connect)
+        except Exception:
+            vtm.close()
+            raise
+        self.vtm_cache.put(hostname, vtm)
+        return vtm
+
+    def _enable_hedging(self, instance, services_director):
+        """
+        Lets slow GETs to an instance reached through one Services Director
+        be raced against the same request through the others.
+        """
+        if not cfg.CONF.http_settings.hedge_reads:
+            return
+        instance.enable_hedging(
+            [
+                instance.instance_url.replace(
+                    services_director.instance_url, replica.instance_url, 1
                 )
-            )
-            try:
-                if not vtm.test_connectivity():
-                    raise Exception("")
-                return vtm
-            except:
-                pass
-            sleep(i)
-        raise Exception("Could not contact vTM instance")
+                for replica in self.services_directors
+                if replica is not services_director
+            ],
+            cfg.CONF.http_settings.hedge_percentile,
+            cfg.CONF.http_settings.hedge_min_delay
+        )
 
     def _assert_not_mgmt_network(self, subnet_id):
         network_id = self.openstack_connector.get_network_for_subnet(subnet_id)
         if network_id == cfg.CONF.lbaas_settings.management_network:
             raise Exception("Specified subnet is part of management network")
 
+    @traced("driver.spawn_vtm")
     def _spawn_vtm(self, hostname, lb):
         """
         Creates a vTM instance as a Nova VM.
         The VM is registered with Services Director to provide licensing and
         configuration proxying.
         """
+        self.vtm_cache.invalidate(hostname)
         services_director = self._get_services_director()
         (mgmt_ip, password) = self.openstack_connector.create_vtm(hostname, lb)
         LOG.info(
@@ -417,28 +560,32 @@ class BrocadeAdxDeviceDriverV2(vTMDeviceDriverCommon):
             cfg.CONF.services_director_settings.username,
             cfg.CONF.services_director_settings.password
         )
-        for counter in xrange(15):
-            try:
-                if not vtm.test_connectivity():
-                    raise Exception("")
-                instance.rest_enabled = True
-                instance.license_name = cfg.CONF.services_director_settings.fla_license
-                instance.update()
-                sleep(5)  # Needed to ensure TIP Groups are always created
-                return vtm
-            except Exception:
-                pass
-            sleep(10)
-        raise Exception(
-            "vTM instance %s failed to boot... Timed out." % hostname
-        )
 
+        def enable_rest():
+            if not vtm.test_connectivity():
+                raise Exception(
+                    "vTM instance %s failed to boot... Timed out." % hostname
+                )
+            instance.rest_enabled = True
+            instance.license_name = \
+                cfg.CONF.services_director_settings.fla_license
+            instance.update()
+        try:
+            self._retry_policy("spawn_vtm").call(enable_rest)
+        finally:
+            vtm.close()
+        sleep(5)  # Needed to ensure TIP Groups are always created
+
+    @traced("driver.destroy_vtm")
     def _destroy_vtm(self, hostname, lb):
         """
         Destroys the vTM Nova VM.
         The vTM is "deleted" in Services Director (this flags the instance
         rather than actually deleting it from the database).
         """
+        self.vtm_cache.invalidate(hostname)
+        if self.stats_collector is not None:
+            self.stats_collector.forget(hostname)
         self.openstack_connector.destroy_vtm(hostname, lb)
         LOG.debug(_("\nvTM %s destroyed" % hostname))
         services_director = self._get_services_director()
@@ -18,17 +18,24 @@
 #
 
 from neutron_lbaas.common.exceptions import LbaasException
+from memory import memory_tracked
+from metrics import instrumented
 from oslo_config import cfg
 from oslo_log import log as logging
+from profiler import profiled
 from vtm import vTM
 from driver_unmanaged import BrocadeAdxDeviceDriverV2 \
     as vTMDeviceDriverUnmanaged
 from time import sleep
 from traceback import format_exc
+from tracing import traced
 
 LOG = logging.getLogger(__name__)
 
 
+@instrumented("driver")
+@profiled
+@memory_tracked
 class BrocadeAdxDeviceDriverV2(vTMDeviceDriverUnmanaged):
     """
     Services Director Unmanaged Version with provisioning of HA pairs.
@@ -128,40 +135,60 @@ class BrocadeAdxDeviceDriverV2(vTMDeviceDriverUnmanaged):
     def _get_hostname(self, id):
         return ("vtm-%s-pri" % (id), "vtm-%s-sec" % (id))
 
+    @traced("driver.get_vtm")
     def _get_vtm(self, hostnames):
+        vtm = self.vtm_cache.get(hostnames)
+        if vtm is not None:
+            return vtm
         services_director = self._get_services_director()
-        for i in xrange(5):
-            for hostname in hostnames:
-                url = "%s/instance/%s/tm/%s" % (
+        vtms = [
+            vTM(
+                "%s/instance/%s/tm/%s" % (
                     services_director.instance_url,
                     hostname,
                     cfg.CONF.vtm_settings.api_version
-                )
-                vtm = vTM(
-                    url,
-                    cfg.CONF.services_director_settings.username,
-                    cfg.CONF.services_director_settings.password,
-                    connectivity_test_url="%s/instance/%s/tm/%s" % (
-                        services_director.connectivity_test_url,
-                        hostname,
-                        cfg.CONF.vtm_settings.api_version
-                    )
-                )
+                ),
+                cfg.CONF.services_director_settings.username,
+                cfg.CONF.services_director_settings.password,
+                connectivity_test_url="%s/instance/%s/tm/%s" % (
+                    services_director.connectivity_test_url,
+                    hostname,
+                    cfg.CONF.vtm_settings.api_version
+                ),
+                **self._vtm_cache_settings()
+            )
+            for hostname in hostnames
+        ]
+        for vtm in vtms:
+            self._enable_hedging(vtm, services_director)
+
+        def connect():
+            for vtm in vtms:
                 try:
-                    if not vtm.test_connectivity():
-                        raise Exception("")
-                    return vtm
+                    if vtm.test_connectivity():
+                        return vtm
                 except Exception:
                     pass
-            sleep(i)
-        raise Exception("Could not contact either vTM instance in cluster")
+            raise Exception("Could not contact either vTM instance in cluster")
+        vtm = None
+        try:
+            vtm = self._retry_policy("get_vtm").call(connect)
+        finally:
+            # Only the member that answered is kept
+            for other in vtms:
+                if other is not vtm:
+                    other.close()
+        self.vtm_cache.put(hostnames, vtm)
+        return vtm
 
+    @traced("driver.spawn_vtm")
     def _spawn_vtm(self, hostnames, lb):
         """
         Creates a vTM HA cluster as Nova VM instances.
         The VMs are registered with Services Director to provide licensing and
         configuration proxying.
         """
+        self.vtm_cache.invalidate(hostnames)
         services_director = self._get_services_director()
         cluster = self.openstack_connector.create_vtms(hostnames, lb)
         LOG.info(_("\nvTMs %s created for tenant %s" % (
@@ -198,31 +225,33 @@ class BrocadeAdxDeviceDriverV2(vTMDeviceDriverUnmanaged):
                 cfg.CONF.services_director_settings.username,
                 cfg.CONF.services_director_settings.password
             )
-            for counter in xrange(15):
-                try:
-                    if not vtm.test_connectivity():
-                        raise Exception("")
-                    instance.rest_enabled = True
-                    instance.license_name = \
-                        cfg.CONF.services_director_settings.fla_license
-                    instance.update()
-                    sleep(5)  # Needed to ensure TIP groups are always created
-                    break
-                except Exception:
-                    pass
-                if counter == 14:
+
+            def enable_rest():
+                if not vtm.test_connectivity():
                     raise Exception(
                         "vTM instance %s failed to boot... Timed out." % (
                             member['hostname']
                         ))
-                sleep(10)
+                instance.rest_enabled = True
+                instance.license_name = \
+                    cfg.CONF.services_director_settings.fla_license
+                instance.update()
+            try:
+                self._retry_policy("spawn_vtm").call(enable_rest)
+            finally:
+                vtm.close()
+            sleep(5)  # Needed to ensure TIP groups are always created
 
+    @traced("driver.destroy_vtm")
     def _destroy_vtm(self, hostnames, lb):
         """
         Destroys the vTM Nova VM.
         The vTM is "deleted" in Services Director (this flags the instance
         rather than actually deleting it from the database).
         """
+        self.vtm_cache.invalidate(hostnames)
+        if self.stats_collector is not None:
+            self.stats_collector.forget(hostnames)
         services_director = self._get_services_director()
         for hostname in hostnames:
             try:
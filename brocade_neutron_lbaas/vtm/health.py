@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Brocade Communications Systems, Inc.  All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+# Matthew Geldert (mgeldert@brocade.com), Brocade Communications Systems,Inc.
+#
+
+from threading import Event, Lock, Thread
+from time import time
+
+
+class CircuitBreaker(object):
+    """
+    Tracks consecutive failures of a single remote endpoint.
+
+    After failure_threshold consecutive failures the breaker opens and the
+    endpoint is skipped.  Once reset_timeout seconds have passed a single
+    trial request is allowed (half-open); its outcome closes or re-opens
+    the breaker.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold=3, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+
+    def allow_request(self):
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN \
+                and time() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            return True
+        return False
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN \
+                or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time()
+
+
+class HealthTracker(object):
+    """
+    Keeps up/down state and recent latency for a set of product instances.
+
+    The best instance (healthy, lowest smoothed latency, then configuration
+    order; or with prefer_order, the first healthy one in configuration
+    order) is recalculated whenever a result is recorded, so get_best() is a
+    simple lookup.  Results come from probe() calls, either on demand or
+    from a background thread started with start(), and can also be fed
+    passively from real traffic through record_request().
+    """
+
+    def __init__(self, instances, failure_threshold=3, reset_timeout=30,
+                 latency_weight=0.3, prefer_order=False):
+        self.instances = list(instances)
+        self.latency_weight = latency_weight
+        self.prefer_order = prefer_order
+        self._breakers = {
+            instance: CircuitBreaker(failure_threshold, reset_timeout)
+            for instance in self.instances
+        }
+        self._latency = {instance: None for instance in self.instances}
+        self._lock = Lock()
+        self._stopped = Event()
+        self._thread = None
+        self._best = self.instances[0] if self.instances else None
+
+    def get_best(self):
+        return self._best
+
+    def is_healthy(self, instance):
+        return self._breakers[instance].state == CircuitBreaker.CLOSED
+
+    def latency(self, instance):
+        return self._latency[instance]
+
+    def record_success(self, instance, latency):
+        with self._lock:
+            self._breakers[instance].record_success()
+            previous = self._latency[instance]
+            if previous is None:
+                self._latency[instance] = latency
+            else:
+                self._latency[instance] = (
+                    self.latency_weight * latency +
+                    (1 - self.latency_weight) * previous
+                )
+            self._update_best()
+
+    def record_failure(self, instance):
+        with self._lock:
+            self._breakers[instance].record_failure()
+            self._update_best()
+
+    def record_request(self, instance, method, url, elapsed, status,
+                       request_bytes=0, response_bytes=0):
+        """
+        Request observer for ProductInstance.add_request_observer().
+        Transport errors and 5xx responses count as failures; any other
+        response shows the instance is alive.
+        """
+        if status is None or status >= 500:
+            self.record_failure(instance)
+        else:
+            self.record_success(instance, elapsed)
+
+    def select(self):
+        """
+        Gets the best healthy instance without contacting it.  Instances
+        whose breaker is due a half-open trial are re-tested in background
+        threads; if no instance is healthy they are all re-tested now.
+        """
+        for instance in self.instances:
+            with self._lock:
+                trial_due = (
+                    self._breakers[instance].state != CircuitBreaker.CLOSED
+                    and self._breakers[instance].allow_request()
+                )
+            if trial_due:
+                thread = Thread(target=self._test, args=(instance,))
+                thread.daemon = True
+                thread.start()
+        best = self._best
+        if best is None:
+            self.probe_all(force=True)
+            best = self._best
+        return best
+
+    def probe(self, instance, force=False):
+        """
+        Tests connectivity to an instance and records the result.  Unless
+        forced, instances whose circuit breaker is open are skipped.
+        """
+        with self._lock:
+            if not self._breakers[instance].allow_request() and not force:
+                return False
+        return self._test(instance)
+
+    def _test(self, instance):
+        start_time = time()
+        try:
+            alive = instance.test_connectivity()
+        except Exception:
+            alive = False
+        if alive:
+            self.record_success(instance, time() - start_time)
+        else:
+            self.record_failure(instance)
+        return alive
+
+    def probe_all(self, force=False):
+        for instance in self.instances:
+            self.probe(instance, force)
+
+    def start(self, interval):
+        """
+        Probes every instance in a background thread once per interval.
+        """
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+
+        def run():
+            while not self._stopped.is_set():
+                self.probe_all()
+                self._stopped.wait(interval)
+        self._thread = Thread(target=run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread = None
+
+    def _update_best(self):
+        healthy = [
+            instance for instance in self.instances
+            if self._breakers[instance].state == CircuitBreaker.CLOSED
+        ]
+        if not healthy:
+            self._best = None
+        elif self.prefer_order:
+            self._best = healthy[0]
+        else:
+            # min() keeps configuration order between equal latencies
+            self._best = min(healthy, key=lambda instance: (
+                self._latency[instance] is None, self._latency[instance]
+            ))
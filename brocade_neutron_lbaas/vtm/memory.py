@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Brocade Communications Systems, Inc.  All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+from collections import deque
+from decorators import wrap_public_methods
+from functools import wraps
+import gc
+import sys
+from time import time
+from types import FunctionType, MethodType, ModuleType
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None  # Python 2.7 without the pytracemalloc backport
+
+_NOT_DATA = (type, ModuleType, FunctionType, MethodType)
+
+
+def approximate_size(root, seen=None, stop_types=()):
+    """
+    Gets the approximate number of bytes used by an object and everything
+    it refers to through containers and instance dictionaries.  Objects
+    whose ids are in seen are not counted again (pass the same set to
+    count shared values once across several calls); instances of stop_types
+    are neither counted nor followed.
+    """
+    if seen is None:
+        seen = set()
+    size = 0
+    pending = [root]
+    while pending:
+        obj = pending.pop()
+        if id(obj) in seen or isinstance(obj, _NOT_DATA) \
+                or (obj is not root and isinstance(obj, stop_types)):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            pending.extend(dict.iterkeys(obj))
+            pending.extend(dict.itervalues(obj))
+        elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+            pending.extend(obj)
+        elif hasattr(obj, "__dict__"):
+            pending.append(obj.__dict__)
+    return size
+
+
+class MemoryTracker(object):
+    """
+    Records how memory changed across driver operations.
+
+    With tracemalloc available, each tracked operation is bracketed by
+    tracemalloc snapshots and the top allocation sites by size change are
+    kept.  Otherwise, the change in the number of gc-tracked objects of each
+    type is kept instead.  The gc does not track strings, numbers, or
+    dictionaries and tuples holding only those, so this mostly shows class
+    instances and nested containers.  Only one operation is tracked at a
+    time, and the results of the latest are kept.
+    """
+
+    def __init__(self, keep=50):
+        self.enabled = False
+        self.top = 10
+        self._diffs = deque(maxlen=keep)
+        self._active = False
+
+    def configure(self, enabled, top):
+        self.top = top
+        self.enabled = enabled
+        if enabled and tracemalloc is not None \
+                and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def call(self, operation, func, *args, **kwargs):
+        """
+        Calls func, recording its memory changes as operation if tracking
+        is enabled and no other operation is being tracked.
+        """
+        if not self.enabled or self._active:
+            return func(*args, **kwargs)
+        self._active = True
+        try:
+            before = self._snapshot()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._diffs.append({
+                    "operation": operation,
+                    "time": time(),
+                    "changes": self._compare(before, self._snapshot())
+                })
+        finally:
+            self._active = False
+
+    def diffs(self):
+        return list(self._diffs)
+
+    def _snapshot(self):
+        if tracemalloc is not None:
+            return tracemalloc.take_snapshot()
+        counts = {}
+        for obj in gc.get_objects():
+            obj_type = type(obj)
+            counts[obj_type] = counts.get(obj_type, 0) + 1
+        return counts
+
+    def _compare(self, before, after):
+        if tracemalloc is not None:
+            return [
+                {
+                    "location": str(stat.traceback),
+                    "size_diff": stat.size_diff,
+                    "count_diff": stat.count_diff
+                }
+                for stat in after.compare_to(before, "lineno")[:self.top]
+            ]
+        changes = [
+            (after.get(obj_type, 0) - before.get(obj_type, 0), obj_type)
+            for obj_type in set(before) | set(after)
+        ]
+        changes.sort(key=lambda (count_diff, _): abs(count_diff), reverse=True)
+        return [
+            {
+                "type": "%s.%s" % (obj_type.__module__, obj_type.__name__),
+                "count_diff": count_diff
+            }
+            for count_diff, obj_type in changes[:self.top]
+            if count_diff
+        ]
+
+
+memory_tracker = MemoryTracker()
+
+
+def memory_tracked(cls):
+    """
+    Class decorator that lets the memory tracker record every public method
+    of the class, including inherited ones.
+    """
+    return wrap_public_methods(cls, "_memory_tracked", _tracked)
+
+
+def _tracked(operation, func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        return memory_tracker.call(operation, func, *args, **kwargs)
+    return wrapper
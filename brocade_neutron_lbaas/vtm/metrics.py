@@ -0,0 +1,402 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Brocade Communications Systems, Inc.  All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from bisect import bisect_left
+from decorators import wrap_public_methods
+from functools import wraps
+import os
+import re
+from threading import Event, Lock, Thread, local
+from slow_log import slow_log
+from time import time
+from tracing import tracer
+from urlparse import urlparse
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+###########
+# METRICS #
+###########
+
+class Counter(object):
+    """
+    A monotonically increasing value for each combination of label values.
+    """
+    type = "counter"
+
+    def __init__(self, name, documentation, label_names):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = Lock()
+
+    def inc(self, label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = \
+                self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = self._values.items()
+        for label_values, value in sorted(values):
+            yield "_total", zip(self.label_names, label_values), value
+
+
+class Histogram(object):
+    """
+    Counts of observed values (e.g. latencies in seconds) in fixed buckets,
+    with their sum, for each combination of label values.
+    """
+    type = "histogram"
+    default_buckets = (
+        0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+        60.0
+    )
+
+    def __init__(self, name, documentation, label_names, buckets=None):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets or self.default_buckets)
+        self._values = {}
+        self._lock = Lock()
+
+    def observe(self, label_values, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(label_values)
+            if counts is None:
+                # One count per bucket, one for +Inf, then the sum
+                counts = self._values[label_values] = \
+                    [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = [
+                (label_values, list(counts))
+                for label_values, counts in self._values.iteritems()
+            ]
+        bounds = [_format_value(bound) for bound in self.buckets] + ["+Inf"]
+        for label_values, counts in sorted(values):
+            labels = zip(self.label_names, label_values)
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                yield "_bucket", labels + [("le", bound)], cumulative
+            yield "_count", labels, cumulative
+            yield "_sum", labels, counts[-1]
+
+
+class MetricsRegistry(object):
+    """
+    Holds the driver's metrics and renders them in the OpenMetrics text
+    format.  Nothing is recorded until enabled is set, so instrumented code
+    costs a single attribute check while metrics are not exported.
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.enabled = False
+        self._metrics = []
+        self._server = None
+        self._writer = None
+
+    def counter(self, name, documentation, label_names=()):
+        metric = Counter(self.prefix + name, documentation, label_names)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, label_names=(), buckets=None):
+        metric = Histogram(
+            self.prefix + name, documentation, label_names, buckets
+        )
+        self._metrics.append(metric)
+        return metric
+
+    def exposition(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append("# TYPE %s %s" % (metric.name, metric.type))
+            lines.append("# HELP %s %s" % (
+                metric.name, _escape(metric.documentation)
+            ))
+            for suffix, labels, value in metric.samples():
+                lines.append("%s%s%s %s" % (
+                    metric.name, suffix, _format_labels(labels),
+                    _format_value(value)
+                ))
+        lines.append("# EOF\n")
+        return "\n".join(lines)
+
+    def write_file(self, path):
+        # Write then rename so that readers never see a partial file
+        temp_path = "%s.tmp" % path
+        with open(temp_path, "w") as metrics_file:
+            metrics_file.write(self.exposition())
+        os.rename(temp_path, path)
+
+    def export_to_file(self, path, interval):
+        """
+        Enables recording and rewrites path with the current metrics once
+        per interval in a background thread.
+        """
+        if self._writer is not None:
+            return
+        self.enabled = True
+        self._writer = Event()
+
+        def run():
+            while not self._writer.wait(interval):
+                try:
+                    self.write_file(path)
+                except Exception:
+                    pass
+        thread = Thread(target=run)
+        thread.daemon = True
+        thread.start()
+
+    def serve(self, address, port):
+        """
+        Enables recording and answers GET requests on address:port with the
+        current metrics in a background thread.
+        """
+        if self._server is not None:
+            return
+        self.enabled = True
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.exposition()
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+        self._server = HTTPServer((address, port), Handler)
+        thread = Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        if self._writer is not None:
+            self._writer.set()
+            self._writer = None
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+        self.enabled = False
+
+
+def _escape(text):
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"' % (name, _escape(str(value)).replace('"', '\\"'))
+        for name, value in labels
+    )
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+registry = MetricsRegistry("brocade_lbaas_")
+
+rest_seconds = registry.histogram(
+    "rest_request_seconds",
+    "Duration of REST calls to vTMs and Services Directors",
+    ("service", "host", "method", "path")
+)
+rest_errors = registry.counter(
+    "rest_request_errors",
+    "REST calls that failed or got an error response",
+    ("service", "host", "method", "path")
+)
+rest_request_bytes = registry.counter(
+    "rest_request_bytes",
+    "Bytes of request bodies sent in REST calls",
+    ("service", "host", "method", "path")
+)
+rest_response_bytes = registry.counter(
+    "rest_response_bytes",
+    "Bytes of response bodies received from REST calls",
+    ("service", "host", "method", "path")
+)
+operation_seconds = registry.histogram(
+    "operation_seconds",
+    "Duration of driver and OpenStack operations",
+    ("component", "operation")
+)
+operation_errors = registry.counter(
+    "operation_errors",
+    "Driver and OpenStack operations that raised an exception",
+    ("component", "operation")
+)
+retry_wait_seconds = registry.histogram(
+    "retry_wait_seconds",
+    "Time spent waiting between retries, per retry site",
+    ("site",)
+)
+
+
+###################
+# INSTRUMENTATION #
+###################
+
+_NAME_SEGMENT = re.compile(r"\d|^[0-9a-f-]{32,}$|^.{33,}$")
+
+
+def path_template(instance_url, url):
+    """
+    Gets the path of a REST URL relative to its product instance, with
+    object names replaced by {name} so that calls to the same kind of
+    object share metrics.  Segments containing a digit (IDs, addresses and
+    hostnames), and very long segments, are taken to be object names.
+    """
+    if url.startswith(instance_url):
+        path = url[len(instance_url):]
+    else:
+        path = urlparse(url).path
+    path = path.split("?", 1)[0]
+    return "/".join(
+        "{name}" if _NAME_SEGMENT.search(segment) else segment
+        for segment in path.split("/")
+    )
+
+
+def record_request(instance, method, url, elapsed, status,
+                   request_bytes=0, response_bytes=0):
+    """
+    Request observer for ProductInstance.add_request_observer().
+    """
+    if not registry.enabled:
+        return
+    labels = (
+        instance.__class__.__name__, urlparse(url).netloc, method,
+        path_template(instance.instance_url, url)
+    )
+    rest_seconds.observe(labels, elapsed)
+    if status is None or status >= 400:
+        rest_errors.inc(labels)
+    if request_bytes:
+        rest_request_bytes.inc(labels, request_bytes)
+    if response_bytes:
+        rest_response_bytes.inc(labels, response_bytes)
+
+
+_active = local()
+
+
+def timed(component, operation, func):
+    """
+    Wraps func to record its duration and failures as an operation, and to
+    trace it as a span named component.operation.  Calls made while the
+    same operation is already being timed in this thread, e.g. an
+    overridden method calling its parent, are not counted again.
+    """
+    key = (component, operation)
+    span_name = "%s.%s" % key
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not registry.enabled and not tracer.enabled:
+            return func(*args, **kwargs)
+        active = _active.__dict__.setdefault("operations", set())
+        if key in active:
+            return func(*args, **kwargs)
+        active.add(key)
+        start_time = time()
+        try:
+            with tracer.span(span_name):
+                return func(*args, **kwargs)
+        except Exception:
+            if registry.enabled:
+                operation_errors.inc(key)
+            raise
+        finally:
+            if registry.enabled:
+                operation_seconds.observe(key, time() - start_time)
+            active.discard(key)
+    wrapper._metrics_timed = True
+    return wrapper
+
+
+def instrumented(component):
+    """
+    Class decorator that times and traces every public method of the
+    class, including inherited ones, as operations of component.
+    """
+    def decorate(cls):
+        return wrap_public_methods(
+            cls, "_metrics_timed",
+            lambda name, func: timed(component, name, func)
+        )
+    return decorate
+
+
+class ClientProxy(object):
+    """
+    Wraps an OpenStack API client so that each of its calls is timed and
+    traced as an operation of component.
+    """
+
+    def __init__(self, client, component):
+        self._client = client
+        self._component = component
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if name.startswith("_") or not callable(attr):
+            return attr
+        return timed(self._component, name, _slow_logged(
+            self._component, name, attr
+        ))
+
+    def __setattr__(self, name, value):
+        if name in ("_client", "_component"):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._client, name, value)
+
+
+def _slow_logged(service, call, func):
+    # Client library calls are logged by name; their bodies aren't visible
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not slow_log.enabled:
+            return func(*args, **kwargs)
+        start_time = time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            slow_log.record(service, call, None, None, time() - start_time)
+    return wrapper
@@ -20,24 +20,33 @@
 import base64
 import json
 from neutronclient.neutron import client as neutron_client
+from metrics import ClientProxy, instrumented, path_template
 from oslo_log import log as logging
 from oslo_config import cfg
 from random import choice, randint
 import re
 import requests
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
+from retry import PermanentError, RetryPolicy
+from slow_log import slow_log
 import socket
 from string import ascii_letters, digits
 from struct import pack
-from time import sleep
+from time import sleep, time
+from tracing import traced
 
 LOG = logging.getLogger(__name__)
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
+@instrumented("openstack")
 class OpenStackInterface(object):
     def __init__(self):
         self.admin_username = cfg.CONF.lbaas_settings.openstack_username
         self.admin_password = cfg.CONF.lbaas_settings.openstack_password
+        self.timeout = (
+            cfg.CONF.http_settings.connect_timeout,
+            cfg.CONF.http_settings.read_timeout
+        )
         # Get Neutron and Nova API endpoints...
         keystone = self.get_keystone_client()
         neutron_service = keystone.services.find(name="neutron")
@@ -259,16 +268,19 @@ class OpenStackInterface(object):
         """
         Waits for a Nova instance to be built.
         """
-        instance = self.get_server(tenant_id, instance_id)
-        status = instance['server']['status']
-        while status == 'BUILD':
-            sleep(10)
+        def check_status():
             instance = self.get_server(tenant_id, instance_id)
             status = instance['server']['status']
             if status == 'ERROR':
                 self.delete_server(tenant_id, instance_id)
-                raise Exception("VM build failed")
-
+                raise PermanentError("VM build failed")
+            if status == 'BUILD':
+                raise Exception("VM %s is still building" % instance_id)
+        RetryPolicy.from_config(
+            "await_build", cfg.CONF.retry_settings.await_build
+        ).call(check_status)
+
+    @traced("openstack.configure_ports")
     def _configure_ports(self, lb, hostname, security_groups=None, cluster=False):
         neutron = self.get_neutron_client()
         # A new port, not tied to a "loadbalancer", is needed as the
@@ -542,8 +554,8 @@ class OpenStackInterface(object):
         try:
             endpoint = self.nova_endpoint.replace("$(tenant_id)s", tenant_id)
             endpoint = endpoint.replace("%(tenant_id)s", tenant_id)
-            response = requests.post(
-                "%s/servers" % endpoint,
+            response = self._nova_request(
+                "POST", endpoint, "/servers",
                 data=json.dumps(body),
                 headers=headers
             )
@@ -555,8 +567,8 @@ class OpenStackInterface(object):
         token = self.get_auth_token(tenant_id=tenant_id)
         endpoint = self.nova_endpoint.replace("$(tenant_id)s", tenant_id)
         endpoint = endpoint.replace("%(tenant_id)s", tenant_id)
-        response = requests.get(
-            "%s/servers/%s" % (endpoint, server_id),
+        response = self._nova_request(
+            "GET", endpoint, "/servers/%s" % server_id,
             headers={"X-Auth-Token": token}
         )
         if response.status_code != 200:
@@ -567,8 +579,8 @@ class OpenStackInterface(object):
         token = self.get_auth_token(tenant_id=tenant_id)
         endpoint = self.nova_endpoint.replace("$(tenant_id)s", tenant_id)
         endpoint = endpoint.replace("%(tenant_id)s", tenant_id)
-        response = requests.post(
-            "%s/servers/%s/action" % (endpoint, server_id),
+        response = self._nova_request(
+            "POST", endpoint, "/servers/%s/action" % server_id,
             headers={
                 "X-Auth-Token": token,
                 "Content-Type": "application/json"
@@ -597,8 +609,8 @@ class OpenStackInterface(object):
         token = self.get_auth_token(tenant_id=tenant_id)
         endpoint = self.nova_endpoint.replace("$(tenant_id)s", tenant_id)
         endpoint = endpoint.replace("%(tenant_id)s", tenant_id)
-        response = requests.get(
-            "%s/servers" % endpoint,
+        response = self._nova_request(
+            "GET", endpoint, "/servers",
             headers={"X-Auth-Token": token}
         )
         for server in response.json()['servers']:
@@ -614,18 +626,40 @@ class OpenStackInterface(object):
         token = self.get_auth_token(tenant_id=tenant_id)
         endpoint = self.nova_endpoint.replace("$(tenant_id)s", tenant_id)
         endpoint = endpoint.replace("%(tenant_id)s", tenant_id)
-        requests.delete(
-            "%s/servers/%s" % (endpoint, server_id),
+        self._nova_request(
+            "DELETE", endpoint, "/servers/%s" % server_id,
             headers={"X-Auth-Token": token}
         )
 
+    def _nova_request(self, method, endpoint, path, data=None, headers=None):
+        """
+        Makes a Nova API call, recording it in the slow log if necessary.
+        """
+        url = "%s%s" % (endpoint, path)
+        start_time = time()
+        status = None
+        response_bytes = 0
+        try:
+            response = requests.request(
+                method, url, data=data, headers=headers, timeout=self.timeout
+            )
+            status = response.status_code
+            response_bytes = len(response.content)
+            return response
+        finally:
+            slow_log.record(
+                "Nova", method, path_template(endpoint, url), status,
+                time() - start_time, data, response_bytes
+            )
+
     def get_neutron_client(self):
         auth_token = self.get_auth_token()
         neutron = neutron_client.Client(
-            '2.0', endpoint_url=self.neutron_endpoint, token=auth_token
+            '2.0', endpoint_url=self.neutron_endpoint, token=auth_token,
+            timeout=cfg.CONF.http_settings.read_timeout
         )
         neutron.format = 'json'
-        return neutron
+        return ClientProxy(neutron, "neutron")
 
     def get_keystone_client(self, tenant_id=None, tenant_name=None):
         auth_url = re.match(
@@ -649,6 +683,7 @@ class OpenStackInterface(object):
             username=self.admin_username,
             password=self.admin_password,
             auth_url=auth_url,
+            timeout=cfg.CONF.http_settings.read_timeout,
             **param
         )
 
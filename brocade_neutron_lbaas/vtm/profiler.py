@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Brocade Communications Systems, Inc.  All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+from decorators import wrap_public_methods
+import errno
+from functools import wraps
+import os
+from random import random
+import signal
+import sys
+from tempfile import NamedTemporaryFile
+try:
+    # Under eventlet, the patched get_ident() identifies green threads
+    from eventlet.patcher import original
+    _get_ident = original("thread").get_ident
+except ImportError:
+    from thread import get_ident as _get_ident
+
+# Frames of this module's own wrappers are left out of sampled stacks
+_module_globals = globals()
+
+
+class Profiler(object):
+    """
+    Statistical CPU profiler for a random sample of driver calls.
+
+    While a sampled call runs, a SIGPROF timer interrupts the process every
+    interval seconds of CPU time and the interrupted Python stack is
+    counted, from the driver method down.  Counts are aggregated per driver
+    method and written to <directory>/<method>.<pid>.collapsed in the
+    collapsed stack format read by flame graph tools.  Neutron runs its
+    green threads in the main thread, where the signal is delivered; calls
+    made in any other thread are not profiled.
+    """
+
+    def __init__(self):
+        self.sample_rate = 0.0
+        self.interval = 0.005
+        self.directory = None
+        self._active = {}
+        self._stacks = {}
+        self._main_thread = None
+
+    def configure(self, sample_rate, interval, directory):
+        if sample_rate > 0:
+            try:
+                os.makedirs(directory)
+            except OSError as e:
+                # Other Neutron workers may be creating it at the same time
+                if e.errno != errno.EEXIST:
+                    raise
+        self.interval = interval
+        self.directory = directory
+        self.sample_rate = sample_rate
+
+    def call(self, operation, func, *args, **kwargs):
+        """
+        Calls func, profiling it as operation if this call is sampled.
+        """
+        if self.sample_rate <= 0 or random() >= self.sample_rate \
+                or self._active or not self._start(operation):
+            return func(*args, **kwargs)
+        entry = sys._getframe()
+        self._active[entry] = operation
+        try:
+            return func(*args, **kwargs)
+        finally:
+            del self._active[entry]
+            if not self._active:
+                signal.setitimer(signal.ITIMER_PROF, 0)
+            self._write(operation)
+
+    def _start(self, operation):
+        if self._main_thread is None:
+            try:
+                signal.signal(signal.SIGPROF, self._sample)
+            except ValueError:
+                return False  # Not the main thread
+            # Don't let samples make blocking calls fail with EINTR
+            signal.siginterrupt(signal.SIGPROF, False)
+            self._main_thread = _get_ident()
+        elif _get_ident() != self._main_thread:
+            return False
+        self._stacks.setdefault(operation, {})
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        return True
+
+    def _sample(self, signum, frame):
+        # Runs in the signal handler, so it must not take locks
+        frames = []
+        while frame is not None:
+            operation = self._active.get(frame)
+            if operation is not None:
+                stack = ";".join(reversed(frames))
+                stacks = self._stacks[operation]
+                stacks[stack] = stacks.get(stack, 0) + 1
+                return
+            if frame.f_globals is not _module_globals:
+                code = frame.f_code
+                frames.append("%s:%s" % (
+                    os.path.basename(code.co_filename), code.co_name
+                ))
+            frame = frame.f_back
+
+    def _write(self, operation):
+        stacks = dict(self._stacks[operation])
+        path = os.path.join(
+            self.directory, "%s.%d.collapsed" % (operation, os.getpid())
+        )
+        # Write then rename so that readers never see a partial file
+        try:
+            with NamedTemporaryFile(dir=self.directory, delete=False) as temp:
+                for stack, count in sorted(stacks.iteritems()):
+                    temp.write("%s %d\n" % (stack, count))
+            os.rename(temp.name, path)
+        except (IOError, OSError):
+            pass
+
+
+profiler = Profiler()
+
+
+def profiled(cls):
+    """
+    Class decorator that lets the profiler sample every public method of
+    the class, including inherited ones.
+    """
+    return wrap_public_methods(cls, "_profiled", _sampled)
+
+
+def _sampled(operation, func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        return profiler.call(operation, func, *args, **kwargs)
+    return wrapper
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Brocade Communications Systems, Inc.  All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+# Matthew Geldert (mgeldert@brocade.com), Brocade Communications Systems,Inc.
+#
+
+from metrics import registry, retry_wait_seconds
+from oslo_log import log as logging
+from random import random
+import sys
+from threading import Lock
+from time import sleep, time
+from tracing import tracer
+
+LOG = logging.getLogger(__name__)
+
+
+class PermanentError(Exception):
+    """
+    Raised by a retried call to stop any further attempts.
+    """
+    pass
+
+
+def is_retryable(error):
+    """
+    Default error classification: everything is retried except
+    PermanentErrors and HTTP 4xx responses other than 408 and 429.
+    """
+    if isinstance(error, PermanentError):
+        return False
+    status_code = getattr(error, "status_code", None)
+    if status_code is not None and 400 <= status_code < 500 \
+            and status_code not in (408, 429):
+        return False
+    return True
+
+
+class WaitRecorder(object):
+    """
+    Keeps a running total of the time spent waiting between retries at
+    each call site.  Each wait is also recorded in the retry_wait_seconds
+    metric while metrics are exported.
+    """
+
+    def __init__(self):
+        self._sites = {}
+        self._lock = Lock()
+
+    def record(self, site, attempt, delay, error):
+        LOG.debug(_("\n%s: attempt %s failed (%s); retrying in %.2fs" % (
+            site, attempt, error, delay
+        )))
+        with self._lock:
+            try:
+                totals = self._sites[site]
+            except KeyError:
+                totals = self._sites[site] = {
+                    "waits": 0, "seconds": 0.0, "longest": 0.0
+                }
+            totals['waits'] += 1
+            totals['seconds'] += delay
+            totals['longest'] = max(totals['longest'], delay)
+        if registry.enabled:
+            retry_wait_seconds.observe((site,), delay)
+
+    def summary(self):
+        """
+        Gets {site: {"waits": count, "seconds": total, "longest": seconds}}.
+        """
+        with self._lock:
+            return {site: dict(totals) for site, totals in self._sites.items()}
+
+    def reset(self):
+        with self._lock:
+            self._sites = {}
+
+
+wait_recorder = WaitRecorder()
+
+
+class RetryPolicy(object):
+    """
+    Retries a call with jittered exponential backoff.
+
+    Attempts stop when max_attempts is reached, when the next wait would
+    take the operation past its deadline (seconds from the first attempt),
+    or when the error is not retryable.  The last error is then re-raised.
+    """
+
+    def __init__(self, site, max_attempts=None, base_delay=1.0,
+                 max_delay=30.0, multiplier=2.0, jitter=0.2, deadline=None,
+                 retryable=is_retryable):
+        if max_attempts is None and deadline is None:
+            raise Exception(
+                "Retry policy %s needs max_attempts or a deadline" % site
+            )
+        self.site = site
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.deadline = deadline
+        self.retryable = retryable
+
+    @classmethod
+    def from_config(cls, site, settings):
+        """
+        Builds a policy from a dictionary of settings, e.g. an oslo.config
+        DictOpt value.  Unknown keys are ignored.
+        """
+        kwargs = {}
+        for key in ["base_delay", "max_delay", "multiplier", "jitter",
+                    "deadline"]:
+            if settings.get(key) not in (None, ""):
+                kwargs[key] = float(settings[key])
+        if settings.get("max_attempts") not in (None, ""):
+            kwargs['max_attempts'] = int(settings['max_attempts'])
+        return cls(site, **kwargs)
+
+    def delay(self, attempt):
+        """
+        Gets the wait after the given (1-based) failed attempt.
+        """
+        delay = min(
+            self.max_delay,
+            self.base_delay * self.multiplier ** (attempt - 1)
+        )
+        return delay * (1 - self.jitter * random())
+
+    def call(self, func, *args, **kwargs):
+        with tracer.span("retry.%s" % self.site) as span:
+            return self._call(span, func, args, kwargs)
+
+    def _call(self, span, func, args, kwargs):
+        start_time = time()
+        attempt = 0
+        while True:
+            attempt += 1
+            span.set("attempts", attempt)
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                exc_info = sys.exc_info()
+                if not self.retryable(e):
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                if self.max_attempts is not None \
+                        and attempt >= self.max_attempts:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                delay = self.delay(attempt)
+                if self.deadline is not None \
+                        and time() - start_time + delay > self.deadline:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                wait_recorder.record(self.site, attempt, delay, e)
+                sleep(delay)
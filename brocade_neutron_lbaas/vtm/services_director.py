@@ -18,11 +18,16 @@
 #
 
 from abstract_product import ConfigObject, ConfigObjectList, SubList,\
-                             ConfigObjectFactory, ProductInstance
+                             ConfigObjectFactory, ProductInstance,\
+                             worker_pool
 import json
 
 
 class ServicesDirectorConfigObject(ConfigObject):
+    _field_depth = 0
+    _internal = frozenset(['name', 'connector'])
+    # Fields indexed by ServicesDirectorConfigObjectList
+    _indexed = frozenset(['tag', 'status'])
 
     def create_from_config_data(self, data):
         try:
@@ -32,36 +37,41 @@ class ServicesDirectorConfigObject(ConfigObject):
         for field, value in data.iteritems():
             setattr(self, field, value)
 
+    def __setattr__(self, name, value):
+        parent = self.__dict__.get("_parent_list") \
+            if name in self._indexed else None
+        if parent is None:
+            super(ServicesDirectorConfigObject, self).__setattr__(name, value)
+            return
+        parent._unindex(self.name, self)
+        super(ServicesDirectorConfigObject, self).__setattr__(name, value)
+        parent._index(self.name, self)
+
     def to_dict(self, ignore_properties=None):
         obj_dict = {}
-        properties = vars(self).copy()
-        ignore = ['name', '_object_type', 'connector', '_parent_queue',
-                  '_url_modifiers']
+        properties = self.__dict__
+        ignore = self._internal
         if ignore_properties:
-            ignore += ignore_properties
+            ignore = ignore.union(ignore_properties)
         try:
             if properties['_is_activatable'] is False \
                 and properties['status'] != "Inactive":
-                ignore.append('status')
+                ignore = ignore.union(['status'])
         except KeyError:
             pass
-        for p in ignore:
-            try:
-                del properties[p]
-            except KeyError:
-                pass
         for field, value in properties.iteritems():
+            if field in ignore or field.startswith("_"):
+                continue
             if isinstance(value, SubList):
-                tmp_list = []
-                for item in value:
-                    tmp_list.append(value.show(item))
-                value = tmp_list
-            if not field.startswith("_"):
-                obj_dict[field] = value
+                value = [value.show(item) for item in value]
+            obj_dict[field] = value
         return obj_dict
 
 
 class ServicesDirectorUserObject(ServicesDirectorConfigObject):
+    # Always send the whole object, serialized without the username
+    _field_depth = None
+
     def __str__(self):
         return json.dumps(self.to_dict(ignore_properties=["username"]))
 
@@ -107,17 +117,66 @@ class ServicesDirectorLicenseObject(ServicesDirectorConfigObject):
 
 
 class ServicesDirectorConfigObjectList(ConfigObjectList):
+    """
+    Dictionary of Services Director objects.
+
+    Objects are indexed by status, and by tag for those that aren't
+    Deleted, so lookups by tag don't have to scan the (mostly historical)
+    instances.  The indexes follow changes to an object's tag or status.
+    """
+
+    def __init__(self, object_class, connector, initialized):
+        super(ServicesDirectorConfigObjectList, self).__init__(
+            object_class, connector, initialized
+        )
+        self._live_by_tag = {}
+        self._by_status = {}
+
+    def _index_data(self):
+        return super(ServicesDirectorConfigObjectList, self)._index_data() + [
+            self._live_by_tag, self._by_status
+        ]
+
+    def _index(self, name, obj):
+        status = getattr(obj, "status", None)
+        if status is None:
+            return
+        self._by_status.setdefault(status, set()).add(name)
+        tag = getattr(obj, "tag", None)
+        if tag is not None and status != "Deleted":
+            self._live_by_tag.setdefault(tag, set()).add(name)
+
+    def _unindex(self, name, obj):
+        for index, key in [(self._by_status, getattr(obj, "status", None)),
+                           (self._live_by_tag, getattr(obj, "tag", None))]:
+            names = index.get(key)
+            if names is not None:
+                names.discard(name)
+                if not names:
+                    del index[key]
+
+    def __setitem__(self, name, obj):
+        if dict.__contains__(self, name):
+            self._unindex(name, dict.__getitem__(self, name))
+        super(ServicesDirectorConfigObjectList, self).__setitem__(name, obj)
+        self._index(name, obj)
+
+    def __delitem__(self, name):
+        self._unindex(name, dict.__getitem__(self, name))
+        super(ServicesDirectorConfigObjectList, self).__delitem__(name)
+
+    def with_status(self, status):
+        """
+        Gets the objects with the given status.
+        """
+        self.materialize()
+        return [
+            dict.__getitem__(self, name)
+            for name in self._by_status.get(status, ())
+        ]
 
-    def populate_from_instance(self):
-        obj_list = json.loads(self.connector())  # Default args get list
-        for obj in obj_list['children']:
-            obj_name = obj['name']
-            obj_data = self.connector(obj_name)
-            try:
-                obj_config = json.loads(obj_data)  # Will fail for rules :S
-            except ValueError:
-                obj_config = obj_data
-            self.instantiate(obj_name, config=obj_config)
+    def populate_from_instance(self, concurrency=1):
+        worker_pool.map(self._populate_child, self._child_names(), concurrency)
 
     def create(self, name, *args, **kwargs):
         new_object = super(ServicesDirectorConfigObjectList, self).create(
@@ -144,14 +203,12 @@ class ServicesDirectorConfigObjectList(ConfigObjectList):
     def __getitem__(self, key):
         # Support getting instances by tag name as well as actual name
         try:
-            return dict.__getitem__(self, key)
+            return super(ServicesDirectorConfigObjectList, self).__getitem__(
+                key
+            )
         except KeyError:
-            for k, v in self.iteritems():
-                try:
-                    if v.tag == key and v.status != "Deleted":
-                        return v
-                except AttributeError:
-                    pass
+            for name in self._live_by_tag.get(key, ()):
+                return dict.__getitem__(self, name)
             raise KeyError(key)
 
 
@@ -295,8 +352,10 @@ class ServicesDirector(ProductInstance):
     }
 
     def __init__(self, base_url, username, password, initialize_config=True,
-                 connectivity_test_url=None):
+                 connectivity_test_url=None, populate_concurrency=1,
+                 prefetch=None):
         super(ServicesDirector, self).__init__(
             base_url, username, password, ServicesDirectorConfigObjectList,
-            initialize_config, connectivity_test_url
+            initialize_config, connectivity_test_url, populate_concurrency,
+            prefetch
         )
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Brocade Communications Systems, Inc.  All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+import json
+import re
+from threading import Lock
+from time import time
+from tracing import tracer
+
+# PEM blocks, and the values of JSON fields that hold keys, passwords or
+# data that embeds them (e.g. Nova user_data)
+_PEM_BLOCK = re.compile(
+    r"-----BEGIN [^-]+-----.*?-----END [^-]+-----", re.DOTALL
+)
+_SECRET_FIELD = re.compile(
+    r'("[^"]*(?:key|pass|secret|token|private|user_data)[^"]*"\s*:\s*)'
+    r'"(?:[^"\\]|\\.)*"',
+    re.IGNORECASE
+)
+
+
+def redact(body):
+    body = _PEM_BLOCK.sub("<redacted>", body)
+    return _SECRET_FIELD.sub(r'\1"<redacted>"', body)
+
+
+class SlowLog(object):
+    """
+    Records REST and API calls that take longer than threshold seconds,
+    with their sizes and the driver operation that made them.  Each entry
+    is passed as a dictionary to sink; a redacted excerpt of the request
+    body is included so that large payloads can be recognised.
+    """
+    excerpt_length = 256
+
+    def __init__(self):
+        self.threshold = None
+        self.sink = None
+
+    @property
+    def enabled(self):
+        return self.threshold is not None
+
+    def configure(self, threshold, sink):
+        self.sink = sink
+        self.threshold = threshold or None
+
+    def record(self, service, method, url, status, elapsed, request_body=None,
+               response_bytes=0):
+        if self.threshold is None or elapsed < self.threshold:
+            return
+        operation = tracer.root()
+        entry = {
+            "time": time(),
+            "operation": operation.name if operation else None,
+            "service": service,
+            "method": method,
+            "url": url,
+            "status": status,
+            "elapsed": elapsed,
+            "request_bytes": len(request_body or ""),
+            "response_bytes": response_bytes
+        }
+        if request_body:
+            entry['request_excerpt'] = \
+                redact(request_body)[:self.excerpt_length]
+        try:
+            self.sink(entry)
+        except Exception:
+            pass
+
+
+class JSONLinesSink(object):
+    """
+    Appends slow log entries to a file as lines of JSON.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = Lock()
+
+    def __call__(self, entry):
+        line = json.dumps(entry)
+        with self._lock:
+            with open(self.path, "a") as log_file:
+                log_file.write(line + "\n")
+
+
+slow_log = SlowLog()
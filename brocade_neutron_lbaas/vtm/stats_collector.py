@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Brocade Communications Systems, Inc.  All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+from abstract_product import worker_pool
+from array import array
+from oslo_log import log as logging
+from threading import Event, Lock, Thread
+from time import time
+
+LOG = logging.getLogger(__name__)
+
+
+class StatsSeries(object):
+    """
+    A fixed number of the most recent statistics samples of one vTM or
+    listen IP, held in ring buffers of typed arrays.  Cumulative counters
+    are turned into per-second rates over any window of the samples.
+    """
+    counters = ("bytes_in", "bytes_out", "total_connections")
+    gauges = ("active_connections",)
+
+    def __init__(self, size):
+        self.size = size
+        self.count = 0
+        self._next = 0
+        self._times = array("d", [0.0]) * size
+        self._values = {
+            name: array("d", [0.0]) * size
+            for name in self.counters + self.gauges
+        }
+
+    def add(self, timestamp, sample):
+        if self.count and timestamp <= self._times[self._next - 1]:
+            return
+        self._times[self._next] = timestamp
+        for name, values in self._values.iteritems():
+            values[self._next] = sample[name]
+        self._next = (self._next + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def rates(self, window=None):
+        """
+        Gets the average rate of each counter, and the average of each
+        gauge, over the samples from the last window seconds (or all of
+        them).  Returns None until there are two samples to compare.
+        """
+        times = self._ordered(self._times)
+        first = 0
+        if window is not None:
+            while first < len(times) and times[first] < times[-1] - window:
+                first += 1
+        if len(times) - first < 2:
+            return None
+        seconds = times[-1] - times[first]
+        rates = {"seconds": seconds}
+        for name in self.counters:
+            values = self._ordered(self._values[name])[first:]
+            # A counter that went down was reset, e.g. by a vTM restart
+            increase = sum(
+                current - previous if current >= previous else current
+                for previous, current in zip(values, values[1:])
+            )
+            rates["%s_per_second" % name] = increase / seconds
+        for name in self.gauges:
+            values = self._ordered(self._values[name])[first:]
+            rates["average_%s" % name] = sum(values) / len(values)
+        return rates
+
+    def _ordered(self, values):
+        # Oldest sample first
+        start = (self._next - self.count) % self.size
+        return (values[start:] + values[:start])[:self.count]
+
+
+class StatsCollector(object):
+    """
+    Keeps the latest statistics of every vTM (or vTM cluster) that the
+    driver has been asked about.
+
+    A target is any hashable naming a vTM, together with a function that
+    returns a vTM object for it.  Statistics are held per target for each
+    listen IP (or None for the globals) that get() has been called for; a
+    background thread started with start() re-reads them once per interval,
+    so get() is normally a dictionary lookup.  If a sweep cannot reach a vTM
+    the last values are kept, and they are served until they are max_age
+    seconds old.  Keys that get() has not been called for in max_age seconds
+    are no longer collected.  The last samples of each key are kept in a
+    StatsSeries for rates().
+    """
+
+    def __init__(self, max_age=300, concurrency=1, samples=60):
+        self.max_age = max_age
+        self.concurrency = concurrency
+        self.samples = samples
+        self._sources = {}
+        self._wanted = {}
+        self._table = {}
+        self._series = {}
+        self._lock = Lock()
+        self._stopped = Event()
+        self._thread = None
+
+    @staticmethod
+    def fetch(vtm, listen_ip=None):
+        if listen_ip:
+            return vtm.statistics.listen_ips.snapshot(listen_ip)
+        return vtm.statistics.globals.snapshot()
+
+    @staticmethod
+    def counters(snapshot, listen_ip=None):
+        """
+        Gets the counters of a statistics snapshot under the names used
+        by the LBaaS plugin.
+        """
+        if listen_ip:
+            return {
+                "bytes_in": snapshot.bytes_in,
+                "bytes_out": snapshot.bytes_out,
+                "active_connections": snapshot.current_conn,
+                "total_connections": snapshot.total_conn
+            }
+        return {
+            "bytes_in": snapshot.total_bytes_in,
+            "bytes_out": snapshot.total_bytes_out,
+            "active_connections": snapshot.total_current_conn,
+            "total_connections": snapshot.total_conn
+        }
+
+    def get(self, target, get_vtm, listen_ip=None):
+        """
+        Gets the statistics snapshot for listen_ip (or the globals) of a
+        target.  If nothing recent enough has been collected, the vTM is
+        read now and the key is added to future sweeps.
+        """
+        now = time()
+        with self._lock:
+            self._want(target, get_vtm, listen_ip, now)
+            snapshot = self._table.get((target, listen_ip))
+        if snapshot is None or now - snapshot.fetched_at > self.max_age:
+            snapshot = self.fetch(get_vtm(), listen_ip)
+            with self._lock:
+                self._record(target, listen_ip, snapshot)
+        return snapshot
+
+    def rates(self, target, get_vtm, listen_ip=None, window=None):
+        """
+        Gets per-second rates of the counters of listen_ip (or the globals)
+        of a target from the samples collected in the last window seconds;
+        see StatsSeries.rates().  The vTM is never read by this call, but
+        the key is added to future sweeps.
+        """
+        with self._lock:
+            self._want(target, get_vtm, listen_ip, time())
+            series = self._series.get((target, listen_ip))
+            if series is None:
+                return None
+            return series.rates(window)
+
+    def forget(self, target):
+        """
+        Stops collecting statistics for a target, e.g. a deleted vTM.
+        """
+        with self._lock:
+            self._sources.pop(target, None)
+            for listen_ip in self._wanted.pop(target, {}):
+                self._table.pop((target, listen_ip), None)
+                self._series.pop((target, listen_ip), None)
+
+    def sweep(self):
+        """
+        Re-reads the statistics of every target once.
+        """
+        with self._lock:
+            targets = self._sources.keys()
+        for target in targets:
+            listen_ips = self._expire(target)
+            if not listen_ips:
+                continue
+            try:
+                vtm = self._sources[target]()
+            except Exception as e:
+                LOG.debug(_("\nStatistics not collected for %s: %s" % (
+                    target, e
+                )))
+                continue
+
+            def collect(listen_ip, vtm=vtm, target=target):
+                try:
+                    return self.fetch(vtm, listen_ip)
+                except Exception as e:
+                    LOG.debug(_("\nStatistics not collected for %s %s: %s" % (
+                        target, listen_ip or "globals", e
+                    )))
+            snapshots = worker_pool.map(collect, listen_ips, self.concurrency)
+            with self._lock:
+                if target not in self._sources:
+                    continue
+                for listen_ip, snapshot in zip(listen_ips, snapshots):
+                    if snapshot is not None:
+                        self._record(target, listen_ip, snapshot)
+
+    def start(self, interval):
+        """
+        Sweeps every target in a background thread once per interval.
+        """
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+
+        def run():
+            while not self._stopped.is_set():
+                try:
+                    self.sweep()
+                except Exception as e:
+                    LOG.error(_("\nStatistics sweep failed: %s" % e))
+                self._stopped.wait(interval)
+        self._thread = Thread(target=run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread = None
+
+    def _want(self, target, get_vtm, listen_ip, now):
+        self._sources[target] = get_vtm
+        self._wanted.setdefault(target, {})[listen_ip] = now
+
+    def _record(self, target, listen_ip, snapshot):
+        key = (target, listen_ip)
+        self._table[key] = snapshot
+        if key not in self._series:
+            self._series[key] = StatsSeries(self.samples)
+        self._series[key].add(
+            snapshot.fetched_at, self.counters(snapshot, listen_ip)
+        )
+
+    def _expire(self, target):
+        # Drops keys that nobody has asked about recently and returns the
+        # rest
+        now = time()
+        with self._lock:
+            wanted = self._wanted.get(target, {})
+            for listen_ip, asked_at in wanted.items():
+                if now - asked_at > self.max_age:
+                    del wanted[listen_ip]
+                    self._table.pop((target, listen_ip), None)
+                    self._series.pop((target, listen_ip), None)
+            if not wanted:
+                self._sources.pop(target, None)
+                self._wanted.pop(target, None)
+            return wanted.keys()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Brocade Communications Systems, Inc.  All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+from contextlib import contextmanager
+from functools import wraps
+import json
+from threading import Lock, local
+from time import time
+from uuid import uuid4
+
+
+class Span(object):
+    """
+    One timed step of a driver operation, with the steps it was made of.
+    """
+
+    def __init__(self, name, attributes, parent=None):
+        self.name = name
+        self.attributes = attributes
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else uuid4().hex
+        self.children = []
+        self.start = time()
+        self.duration = None
+        self.error = None
+
+    def set(self, name, value):
+        self.attributes[name] = value
+
+    def finish(self):
+        self.duration = time() - self.start
+
+    def to_dict(self):
+        span_dict = {
+            "name": self.name,
+            "start": self.start,
+            "duration": self.duration
+        }
+        if self.attributes:
+            span_dict['attributes'] = self.attributes
+        if self.error:
+            span_dict['error'] = self.error
+        if self.children:
+            span_dict['children'] = [
+                child.to_dict() for child in list(self.children)
+            ]
+        return span_dict
+
+
+class _NullSpan(object):
+    # Stands in for a span while tracing is disabled
+    def set(self, name, value):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class JSONLinesExporter(object):
+    """
+    Appends each finished trace to a file as one line of JSON.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = Lock()
+
+    def export(self, span):
+        line = json.dumps(dict(span.to_dict(), trace_id=span.trace_id))
+        with self._lock:
+            with open(self.path, "a") as trace_file:
+                trace_file.write(line + "\n")
+
+
+class DiscardExporter(object):
+    """
+    Lets spans be built, e.g. so the slow log can tell which operation a
+    request belongs to, without sending them anywhere.
+    """
+
+    def export(self, span):
+        pass
+
+
+class Tracer(object):
+    """
+    Builds a tree of spans for each driver operation.  The current span is
+    kept per thread; the exporter is given each tree when its outermost
+    span finishes.  With no exporter, span() costs one attribute check.
+    """
+
+    def __init__(self):
+        self.exporter = None
+        self._local = local()
+
+    @property
+    def enabled(self):
+        return self.exporter is not None
+
+    def current(self):
+        return getattr(self._local, "span", None)
+
+    def root(self):
+        """
+        Gets the outermost span of the current trace, i.e. the driver
+        operation being carried out.
+        """
+        span = self.current()
+        while span is not None and span.parent is not None:
+            span = span.parent
+        return span
+
+    @contextmanager
+    def span(self, name, **attributes):
+        if self.exporter is None:
+            yield NULL_SPAN
+            return
+        parent = self.current()
+        span = Span(name, attributes, parent)
+        if parent is not None:
+            parent.children.append(span)
+        self._local.span = span
+        try:
+            yield span
+        except Exception as e:
+            span.error = "%s: %s" % (e.__class__.__name__, e)
+            raise
+        finally:
+            span.finish()
+            self._local.span = parent
+            if parent is None:
+                self._export(span)
+
+    def bind(self, func):
+        """
+        Wraps func so that spans it opens in another thread (e.g. a worker
+        pool thread) become children of the current span.
+        """
+        parent = self.current()
+        if parent is None:
+            return func
+
+        @wraps(func)
+        def bound(*args, **kwargs):
+            previous = self.current()
+            self._local.span = parent
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self._local.span = previous
+        return bound
+
+    def _export(self, span):
+        try:
+            self.exporter.export(span)
+        except Exception:
+            pass
+
+
+def traced(name):
+    """
+    Decorator that runs a function in a span called name.
+    """
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if tracer.exporter is None:
+                return func(*args, **kwargs)
+            with tracer.span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def load_exporter(name, path):
+    """
+    Gets an exporter instance: "jsonlines" for a JSONLinesExporter, or the
+    dotted path of a class that is constructed with path and has an
+    export(span) method.
+    """
+    if name == "jsonlines":
+        return JSONLinesExporter(path)
+    module_name, class_name = name.rsplit(".", 1)
+    module = __import__(module_name, fromlist=[class_name])
+    return getattr(module, class_name)(path)
+
+
+tracer = Tracer()
@@ -19,58 +19,200 @@
 
 from abstract_product import ConfigObject, ConfigObjectList, SubList,\
                              ConfigObjectFactory, TextOnlyObjectFactory,\
-                             ProductInstance
+                             ProductInstance, RESTError, gather,\
+                             http_sessions, worker_pool
+from collections import OrderedDict
 import json
+from memory import approximate_size
+import sys
+from threading import Lock
+from time import time
 
 ###############################################################################
 #                           Abstract config object classes                    #
 ###############################################################################
 
 
-class vTMConfigObject(ConfigObject):
+class FieldCodec(object):
+    """
+    Serializer/deserializer between the "properties" sections of a vTM
+    JSON body and the attributes of one config object class.
 
-    def create_from_config_data(self, data):
-        protected = ['update', 'delete']
+    Fields in the "basic" section map to attributes of the same name, and
+    fields in other sections to "<section>__<field>".  Each name is
+    translated once per class and then reused by every object, which also
+    means objects share one copy of each attribute name.
+    """
+    protected = frozenset(['update', 'delete'])
+
+    def __init__(self, internal):
+        self.internal = frozenset(internal)
+        self._attributes = {}
+        self._fields = {}
+
+    def attribute(self, section, field):
         try:
-            data = json.loads(data)
-        except TypeError:
+            return self._attributes[(section, field)]
+        except KeyError:
             pass
-        for section in data['properties']:
-            if section == "basic":
-                for field, value in data['properties'][section].iteritems():
-                    if field not in protected:
-                        setattr(self, field, value)
-            else:
-                for field, value in data['properties'][section].iteritems():
-                    setattr(self, "%s__%s" % (section, field), value)
+        name = field if section == "basic" else "%s__%s" % (section, field)
+        try:
+            name = intern(str(name))
+        except UnicodeEncodeError:
+            pass
+        self._attributes[(section, field)] = name
+        return name
 
-    def to_dict(self, ignore_properties=None):
-        obj_dict = {"properties": {"basic": {}}}
-        properties = vars(self).copy()
-        ignore = ['name', '_object_type', 'connector', '_parent_list']
-        if ignore_properties:
-            ignore += ignore_properties
-        for p in ignore:
+    def field(self, attribute):
+        try:
+            return self._fields[attribute]
+        except KeyError:
+            pass
+        name = attribute[1:] if attribute.startswith("_") else attribute
+        try:
+            section, field = name.split("__")
+        except ValueError:
+            section, field = "basic", name
+        self._fields[attribute] = (section, field)
+        return section, field
+
+    def decode(self, obj, properties, keep_existing=False):
+        """
+        Sets obj's attributes from the sections of a decoded body.  With
+        keep_existing, attributes that are already set are left alone.
+        """
+        attributes = obj.__dict__
+        for section, fields in properties.iteritems():
+            for field, value in fields.iteritems():
+                if section == "basic" and field in self.protected:
+                    continue
+                name = self.attribute(section, field)
+                if keep_existing and name in attributes:
+                    continue
+                attributes[name] = value
+
+    def encode(self, obj, properties, ignore=()):
+        """
+        Adds obj's field attributes to a dictionary of sections.
+        """
+        for name, value in obj.__dict__.iteritems():
+            if name in self.internal or name in ignore:
+                continue
+            if isinstance(value, SubList):
+                value = [item.to_dict() for item in value.itervalues()]
+            section, field = self.field(name)
             try:
-                del properties[p]
+                properties[section][field] = value
             except KeyError:
-                pass
-        for field, value in properties.iteritems():
-            if isinstance(value, SubList):
-                tmp_list = []
-                for item in value:
-                    n = value.get(item)
-                    tmp_list.append(n.to_dict())
-                value = tmp_list
-            if field.startswith("_"):
-                field = field[1:]
+                properties[section] = {field: value}
+        return properties
+
+
+class vTMConfigObject(ConfigObject):
+    """
+    vTM configuration object.
+
+    Fields in the "basic" section are exposed as attributes of the same
+    name, and fields in other sections as "<section>__<field>".  When built
+    from a JSON body, the body is kept as it was received and only decoded
+    into attributes when a field is first accessed; serializing or
+    re-sending an untouched object never decodes it into attributes.
+    """
+    _field_depth = 2
+    # Attributes that are not configuration fields
+    _internal = ['name', '_object_type', 'connector', '_parent_list',
+                 '_saved_fields', '_raw', '_saved_raw']
+
+    @classmethod
+    def codec(cls):
+        """
+        Gets the FieldCodec for this class, creating it on first use.
+        """
+        try:
+            return cls.__dict__['_codec']
+        except KeyError:
+            cls._codec = FieldCodec(cls._internal)
+            return cls._codec
+
+    def create_from_config_data(self, data):
+        if isinstance(data, basestring):
+            self._raw = data
+        else:
+            self.codec().decode(self, data['properties'])
+
+    def _decode(self):
+        raw = self.__dict__.pop("_raw", None)
+        if raw is not None:
+            # Fields assigned before decoding take precedence
+            self.codec().decode(
+                self, json.loads(raw)['properties'], keep_existing=True
+            )
+
+    def _raw_dict(self, raw):
+        properties = json.loads(raw)['properties']
+        basic = properties.setdefault("basic", {})
+        for field in self.codec().protected:
+            basic.pop(field, None)
+        return {"properties": properties}
+
+    def _index_values(self, attributes):
+        if "_raw" not in self.__dict__:
+            return super(vTMConfigObject, self)._index_values(attributes)
+        # Read fields straight from the body, leaving it undecoded
+        properties = json.loads(self._raw)['properties']
+        codec = self.codec()
+        values = {}
+        for attribute in attributes:
+            if attribute in self.__dict__:
+                values[attribute] = self.__dict__[attribute]
+                continue
+            section, field = codec.field(attribute)
             try:
-                section, field_name = field.split("__")
-                if section not in obj_dict['properties']:
-                    obj_dict['properties'][section] = {}
-                obj_dict['properties'][section][field_name] = value
-            except ValueError:
-                obj_dict['properties']['basic'][field] = value
+                values[attribute] = properties[section][field]
+            except KeyError:
+                pass
+        return values
+
+    def __getattr__(self, name):
+        # Only called for attributes that aren't set, so decode and retry
+        if name.startswith("_") or "_raw" not in self.__dict__:
+            raise AttributeError(name)
+        self._decode()
+        try:
+            return self.__dict__[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __delattr__(self, name):
+        self._decode()
+        super(vTMConfigObject, self).__delattr__(name)
+
+    def mark_clean(self):
+        internal = self.codec().internal
+        if "_raw" in self.__dict__ \
+                and all(name in internal for name in self.__dict__):
+            # Unchanged since it was received: compare against the body
+            self._saved_raw = self._raw
+            self.__dict__.pop("_saved_fields", None)
+        else:
+            self.__dict__.pop("_saved_raw", None)
+            super(vTMConfigObject, self).mark_clean()
+
+    def _saved_field_digests(self):
+        if "_saved_raw" in self.__dict__:
+            self.__dict__.pop("_saved_fields", None)
+            obj_dict = self._raw_dict(self.__dict__.pop("_saved_raw"))
+            self._saved_fields = self._field_digests(obj_dict)
+        return super(vTMConfigObject, self)._saved_field_digests()
+
+    def to_dict(self, ignore_properties=None):
+        if "_raw" in self.__dict__:
+            obj_dict = self._raw_dict(self._raw)
+        else:
+            obj_dict = {"properties": {"basic": {}}}
+        self.codec().encode(
+            self, obj_dict['properties'], ignore_properties or ()
+        )
         return obj_dict
 
 
@@ -86,16 +228,109 @@ class vTMConfigObjectList(ConfigObjectList):
     manupulating the dictionary.
     """
 
-    def populate_from_instance(self):
-        obj_list = json.loads(self.connector())  # Default args get list
-        for obj in obj_list['children']:
-            obj_name = obj['name']
-            obj_data = self.connector(obj_name)
-            try:
-                obj_config = json.loads(obj_data)  # Will fail for rules :S
-            except ValueError:
-                obj_config = obj_data
-            self.instantiate(obj_name, config=obj_config)
+    def __init__(self, object_class, connector, initialized):
+        super(vTMConfigObjectList, self).__init__(
+            object_class, connector, initialized
+        )
+        self._mirror = None
+        self._mirror_lock = Lock()
+
+    def populate_from_instance(self, concurrency=1):
+        worker_pool.map(self._populate_child, self._child_names(), concurrency)
+
+    def _populate_child(self, name):
+        if not issubclass(self.object_class, vTMConfigObject):
+            return super(vTMConfigObjectList, self)._populate_child(name)
+        # The object decodes the body itself, when it is first used
+        self.instantiate(name, config=self.connector(name))
+
+    def memory_usage(self):
+        usage = super(vTMConfigObjectList, self).memory_usage()
+        if self._mirror is not None:
+            with self._mirror_lock:
+                usage['mirror_bytes'] = approximate_size(self._mirror)
+        return usage
+
+    def enable_mirror(self, ttl=None):
+        """
+        Keeps a write-through copy of every object read from or written to
+        the vTM through this list, so repeated reads are served from memory.
+        Entries expire after ttl seconds (or never, if ttl is None).
+        """
+        if self._mirror is not None:
+            return
+        self._mirror = {}
+        self._mirror_children = None
+        self._mirror_ttl = ttl
+        self._remote_connector = self.connector
+        self.connector = self._mirrored_connector
+
+    def invalidate(self, name=None):
+        """
+        Discards the mirrored copy of an object, or of everything if no
+        name is given, e.g. because the vTM was changed by someone else.
+        """
+        if self._mirror is None:
+            return
+        with self._mirror_lock:
+            if name is None:
+                self._mirror = {}
+            else:
+                self._mirror.pop(name, None)
+            self._mirror_children = None
+
+    def _mirrored_connector(self, name=None, method="GET", data=None,
+                            headers=None):
+        if method == "GET":
+            entry = self._mirror.get(name) if name \
+                else self._mirror_children
+            if entry is not None and (
+                    entry[0] is None or entry[0] > time()):
+                if entry[1] is None:
+                    raise RESTError("%s does not exist (mirrored)" % name, 404)
+                return entry[1]
+        try:
+            response = self._remote_connector(name, method, data, headers)
+        except RESTError as e:
+            if e.status_code == 404 and method == "GET" and name:
+                self._mirror_store(name, None)
+            elif e.status_code is None:
+                self.invalidate()
+            else:
+                self.invalidate(name)
+            raise
+        if method == "GET" and not name:
+            self._mirror_children = (self._mirror_expiry(), response)
+        elif method in ["GET", "PUT"]:
+            self._mirror_store(name, response)
+        elif method == "DELETE":
+            self._mirror_store(name, None)
+        return response
+
+    def _mirror_store(self, name, text):
+        with self._mirror_lock:
+            self._mirror[name] = (self._mirror_expiry(), text)
+            # Keep the mirrored child list consistent with creates and
+            # deletes
+            if self._mirror_children is None:
+                return
+            children = json.loads(self._mirror_children[1])['children']
+            names = [child['name'] for child in children]
+            if text is None and name in names:
+                children = [c for c in children if c['name'] != name]
+            elif text is not None and name not in names:
+                children.append({"name": name})
+            else:
+                return
+            self._mirror_children = (
+                self._mirror_children[0],
+                json.dumps({"children": children})
+            )
+
+    def _mirror_expiry(self):
+        if self._mirror_ttl is None:
+            return None
+        return time() + self._mirror_ttl
 
     def create(self, name, *args, **kwargs):
         new_object = super(vTMConfigObjectList, self).create(
@@ -107,6 +342,119 @@ class vTMConfigObjectList(ConfigObjectList):
         return self.create(name, *args, **kwargs)
 
 
+###############################################################################
+#                                  Change sets                                #
+###############################################################################
+
+class ChangeSet(object):
+    """
+    Collects configuration changes for a vTM and sends them together.
+
+    Creates and updates are sent first, in waves ordered so that objects
+    are written before anything that refers to them (e.g. a rate class
+    before the rule using it, a rule or pool before the virtual server).
+    Deletes follow in the reverse order, once the objects referring to
+    them have been changed or removed.  The changes in each wave are sent
+    concurrently on the worker pool, or one after another if apply() is
+    called from a worker.  Only the last change queued for an object is
+    sent.
+    """
+
+    # Objects that refer to other objects rank above them.
+    DEPENDENCY_RANK = {
+        "rule": 1,
+        "pool": 1,
+        "vserver": 2
+    }
+
+    def __init__(self, vtm):
+        self.vtm = vtm
+        self._changes = OrderedDict()
+
+    def create(self, list_name, name, **kwargs):
+        """
+        Queues the creation (or replacement) of a top-level object, e.g.
+        changes.create("pool", pool_id, config=pool_config).
+        """
+        obj_list = getattr(self.vtm, list_name)
+        self._queue(list_name, name, obj_list.create, name, **kwargs)
+
+    def update(self, list_name, obj):
+        """
+        Queues a PUT of an object that has been retrieved and modified.
+        """
+        self._queue(list_name, obj.name, obj.update)
+
+    def delete(self, list_name, name):
+        """
+        Queues the deletion of a top-level object.  Objects that are
+        already absent are ignored.
+        """
+        obj_list = getattr(self.vtm, list_name)
+        self._queue(list_name, name, self._delete, obj_list, name)
+
+    def __len__(self):
+        return len(self._changes)
+
+    def apply(self):
+        """
+        Sends all queued changes.  If a change fails, the remainder of its
+        wave completes but later waves are not sent and the first error is
+        raised.
+        """
+        writes = {}
+        deletes = {}
+        for (list_name, name), change in self._changes.iteritems():
+            rank = self.DEPENDENCY_RANK.get(list_name, 0)
+            if change[0] == self._delete:
+                deletes.setdefault(rank, []).append(change)
+            else:
+                writes.setdefault(rank, []).append(change)
+        self._changes = OrderedDict()
+        waves = [writes[rank] for rank in sorted(writes)] + \
+                [deletes[rank] for rank in sorted(deletes, reverse=True)]
+        for wave in waves:
+            if worker_pool.in_worker():
+                # Waiting on the pool from one of its own workers could
+                # deadlock once every worker is waiting
+                self._apply_inline(wave)
+                continue
+            gather([
+                worker_pool.submit(func, *args, **kwargs)
+                for func, args, kwargs in wave
+            ]).result()
+
+    @staticmethod
+    def _apply_inline(wave):
+        exc_info = None
+        for func, args, kwargs in wave:
+            try:
+                func(*args, **kwargs)
+            except Exception:
+                if exc_info is None:
+                    exc_info = sys.exc_info()
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+    def _queue(self, list_name, name, func, *args, **kwargs):
+        key = (list_name, name)
+        self._changes.pop(key, None)
+        self._changes[key] = (func, args, kwargs)
+
+    @staticmethod
+    def _delete(obj_list, name):
+        obj_list.forget_writes(name)
+        try:
+            obj_list.connector(name, "DELETE")
+        except RESTError as e:
+            if e.status_code != 404:
+                raise
+        try:
+            del obj_list[name]
+        except KeyError:
+            pass
+
+
 ###############################################################################
 #                         Non-standard config object classes                  #
 ###############################################################################
@@ -118,34 +466,70 @@ class Statistics(object):
         for section in self.sections:
             setattr(self, section, self.Section(stats_url, section, connector))
 
+    class Snapshot(dict):
+        """
+        Read-only statistics from a single request.  Values can be read as
+        items or attributes; fetched_at is when the request was made.
+        """
+        def __init__(self, statistics, fetched_at):
+            super(Statistics.Snapshot, self).__init__(statistics)
+            object.__setattr__(self, "fetched_at", fetched_at)
+
+        def __getattr__(self, name):
+            try:
+                return self[name]
+            except KeyError:
+                raise AttributeError(name)
+
+        def _read_only(self, *args, **kwargs):
+            raise TypeError("Statistics snapshots are read-only")
+
+        __setattr__ = __setitem__ = __delitem__ = clear = pop = popitem = \
+            setdefault = update = _read_only
+
+    # Kept for callers that refer to the old item class
+    ConfigItem = Snapshot
+
     class Section(dict):
         def __init__(self, stats_url, section, connector):
             self.stats_url = stats_url
             self.section = section
             self.connector = connector
-
-        class ConfigItem(dict):
-            def __getattr__(self, name):
-                return self[name]
+            self._snapshots = {}
+
+        def snapshot(self, name=None, ttl=None):
+            """
+            Gets the whole section, or one named item of it, with a single
+            request.  If ttl is given, a snapshot fetched less than ttl
+            seconds ago is returned instead of making a new request.
+            """
+            cached = self._snapshots.get(name)
+            if ttl is not None and cached is not None \
+                    and time() - cached.fetched_at < ttl:
+                return cached
+            url = "%s/%s" % (self.stats_url, self.section)
+            if name is not None:
+                url = "%s/%s" % (url, name)
+            fetched_at = time()
+            response = self.connector.get(url, timeout=http_sessions.timeout)
+            if not 200 <= response.status_code < 300:
+                raise Exception("Failed to get stats from vTM")
+            snapshot = Statistics.Snapshot(
+                response.json()['statistics'], fetched_at
+            )
+            self._snapshots[name] = snapshot
+            return snapshot
 
         def __getitem__(self, name):
-            response = self.connector.get("%s/%s/%s" % (
-                self.stats_url, self.section, name
-            ))
-            return self.ConfigItem(response.json()['statistics'])
+            return self.snapshot(name)
 
         def __getattr__(self, name):
-            response = self.connector.get("%s/%s" % (
-                self.stats_url, self.section
-            ))
-            if 200 <= response.status_code < 300:
-                stats = response.json()
-                try:
-                    return stats['statistics'][name]
-                except KeyError:
-                    raise AttributeError(name)
-            else:
-                raise Exception("Failed to get stats from vTM")
+            if name.startswith("_"):
+                raise AttributeError(name)
+            try:
+                return self.snapshot()[name]
+            except KeyError:
+                raise AttributeError(name)
 
 
 class Node(vTMConfigObject):
@@ -175,7 +559,7 @@ class Node(vTMConfigObject):
         }
 
     def update(self):
-        self.parent.connector("PUT", str(self.parent))
+        self.parent.update()
 
 
 class Pool(vTMConfigObject):
@@ -221,6 +605,8 @@ class Pool(vTMConfigObject):
 class CustomData(vTMConfigObject):
     def __init__(self, name, config=None, **kwargs):
         super(CustomData, self).__init__(name, "CustomData")
+        if isinstance(config, basestring):
+            config = json.loads(config)
         if config:
             for item in config['properties']['basic']['string_lists']:
                 setattr(self, item['name'], item['value'])
@@ -237,14 +623,10 @@ class CustomData(vTMConfigObject):
     def to_dict(self):
         obj_dict = {"properties": {"basic": {}}}
         val_list = []
-        obj_vars = vars(self).copy()
-        for ignore_me in ["name", "_object_type", "connector", "_parent_list"]:
-            try:
-                del obj_vars[ignore_me]
-            except KeyError:
-                pass
-        for key in obj_vars:
-            value = getattr(self, key)
+        internal = self.codec().internal
+        for key, value in self.__dict__.iteritems():
+            if key in internal:
+                continue
             if not isinstance(value, list):
                 value = [value]
             val_list.append(
@@ -460,12 +842,21 @@ class vTM(ProductInstance):
     }
 
     def __init__(self, base_url, username, password, initialize_config=False,
-                 connectivity_test_url=None):
+                 connectivity_test_url=None, mirror_config=False,
+                 mirror_ttl=None, populate_concurrency=1, prefetch=None,
+                 write_suppression_ttl=None):
         url = "%s/config/active" % base_url
         super(vTM, self).__init__(
             url, username, password, vTMConfigObjectList,
-            initialize_config, connectivity_test_url
+            initialize_config, connectivity_test_url, populate_concurrency,
+            prefetch
         )
+        if mirror_config and not initialize_config:
+            for obj_list in self._config_lists:
+                obj_list.enable_mirror(mirror_ttl)
+        if write_suppression_ttl:
+            for obj_list in self._config_lists:
+                obj_list.suppress_unchanged_writes(write_suppression_ttl)
         #   Statistics
         # TODO: have object-specific stats available through the object itself
         self.stats_url = "%s/status/local_tm/statistics" % base_url
@@ -478,13 +869,30 @@ class vTM(ProductInstance):
                 "GlobalSettings", config=conn()
             )
             self.global_settings.connector = conn
+            self.global_settings.mark_clean()
             #   Security
             conn = self.get_object_connector(SecuritySettings, "security")
             self.security = SecuritySettings("SecuritySettings", config=conn())
             self.security.connector = conn
+            self.security.mark_clean()
+
+    def change_set(self):
+        """
+        Gets a ChangeSet for batching configuration changes to this vTM.
+        """
+        return ChangeSet(self)
+
+    def invalidate_mirror(self):
+        """
+        Discards all mirrored configuration and records of previous writes,
+        e.g. after an external change.
+        """
+        for obj_list in self._config_lists:
+            obj_list.invalidate()
+            obj_list.forget_writes()
 
     def get_nodes_in_cluster(self):
         response = self.http_session.get("%s/traffic_managers" % (
             self.instance_url
-        ))
+        ), timeout=http_sessions.timeout)
         return [tm['name'] for tm in response.json()['children']]
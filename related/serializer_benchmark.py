@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+#
+# Copyright 2016 Brocade Communications Systems, Inc.  All rights reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+# Measures how many vTM config objects per second the driver's object model
+# can build from, and serialize back to, REST API JSON bodies.
+#
+# Usage: serializer_benchmark.py [--count=N] [--repeat=N]
+
+import gc
+import json
+import os
+import sys
+from time import time
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "..", "brocade_neutron_lbaas", "vtm"
+))
+from vtm import vTM
+
+BODIES = {
+    "VirtualServer": {"properties": {
+        "basic": {
+            "enabled": True, "listen_on_any": False,
+            "listen_on_traffic_ips": ["tip-1"], "note": "Listener",
+            "pool": "pool-1", "port": 443, "protocol": "http",
+            "request_rules": ["rate-1"], "ssl_decrypt": True
+        },
+        "connection": {"keepalive": True, "timeout": 40},
+        "log": {"enabled": False, "format": "%h %l %u %t \"%r\" %s %b"},
+        "ssl": {
+            "add_cluster_ip": True, "server_cert_default": "cert-1",
+            "server_cert_host_mapping": [
+                {"host": "www.example.com", "certificate": "cert-2"}
+            ]
+        }
+    }},
+    "Pool": {"properties": {
+        "basic": {
+            "monitors": ["monitor-1"], "note": "Pool",
+            "nodes_table": [
+                {"node": "10.0.0.%s:80" % i, "state": "active",
+                 "weight": 1, "priority": 1}
+                for i in xrange(1, 11)
+            ],
+            "persistence_class": ""
+        },
+        "load_balancing": {"algorithm": "weighted_round_robin"}
+    }}
+}
+
+
+def measure(label, count, repeat, func):
+    # Report the best of several runs, without cyclic garbage collection
+    # passes in the timings
+    best = None
+    for _ in xrange(repeat):
+        gc.collect()
+        gc.disable()
+        start_time = time()
+        result = func()
+        elapsed = time() - start_time
+        gc.enable()
+        best = elapsed if best is None else min(best, elapsed)
+    print "%-32s %10.0f objects/s" % (label, count / best)
+    return result
+
+
+def main(count="20000", repeat="5"):
+    count = int(count)
+    repeat = int(repeat)
+    for cls, body in sorted(BODIES.iteritems()):
+        object_class = vTM.config_classes[cls]['class']
+        text = json.dumps(body)
+        print "%s (%s objects)" % (cls, count)
+        objs = measure("  build from body", count, repeat, lambda: [
+            object_class("obj-%s" % i, config=text) for i in xrange(count)
+        ])
+        measure("  serialize untouched", count, repeat, lambda: [
+            str(obj) for obj in objs
+        ])
+        measure("  read one field", count, 1, lambda: [
+            obj.note for obj in objs
+        ])
+        measure("  serialize decoded", count, repeat, lambda: [
+            str(obj) for obj in objs
+        ])
+    return 0
+
+
+if __name__ == "__main__":
+    args = {arg.split("=")[0][2:]: arg.split("=")[1] for arg in sys.argv[1:]}
+    sys.exit(main(**args))